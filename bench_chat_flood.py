@@ -0,0 +1,185 @@
+"""
+Нагрузочный стенд: флуд голосов из чатов → сервер шоу → оверлеи.
+
+Поднимает aiohttp-сервер quiz_stream_show локально (без озвучки и без
+основного цикла), подключает N оверлеев и шлёт голоса от фейковых
+twitch / youtube / tiktok источников по протоколу remote_vote (или
+vote_batch). В конце печатает пропускную способность приёма, задержку
+«голос → оверлей» по перцентилям, прирост памяти и выброшенные кадры.
+
+    python bench_chat_flood.py
+    python bench_chat_flood.py --clients 200 --rate 5000 --duration 20 --batch 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+
+# quiz_stream_show читает банк вопросов и html по относительным путям
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import aiohttp
+from aiohttp import web
+
+import quiz_stream_show as show
+import vote_manager
+
+SOURCES = ("twitch", "youtube", "tiktok")
+LETTERS = ("A", "B", "C", "D")
+
+
+def rss_mb() -> float:
+    # ru_maxrss в Linux — килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[idx]
+
+
+class Overlay:
+    """Фейковый оверлей: считает кадры и задержку до появления голоса в счётчике"""
+
+    def __init__(self):
+        self.frames = 0
+        self.seen_total = 0
+        self.latencies = []
+
+    async def run(self, session, url, sent_at):
+        async with session.ws_connect(url) as ws:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                self.frames += 1
+                data = json.loads(msg.data)
+                if data.get("type") != "votes":
+                    continue
+                now = time.perf_counter()
+                total = data.get("total", 0)
+                # Голос №k виден, как только total дорос до k
+                for k in range(self.seen_total, min(total, len(sent_at))):
+                    self.latencies.append(now - sent_at[k])
+                self.seen_total = max(self.seen_total, total)
+
+
+async def flood(session, url, source, rate, duration, batch_linger, sent_at, counter):
+    """Шлёт голоса с заданной частотой; каждый голос — новый зритель"""
+    async with session.ws_connect(url) as ws:
+        interval = 1.0 / rate
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        i = 0
+        pending = []
+        next_flush = start + batch_linger
+        while loop.time() - start < duration:
+            vote = {
+                "source": source,
+                "username": f"{source}_bot{i}",
+                "message": LETTERS[i % 4],
+                "timestamp": time.time(),
+                "message_id": f"{source}-{i}",
+            }
+            i += 1
+            counter[0] += 1
+            sent_at.append(time.perf_counter())
+            if batch_linger > 0:
+                pending.append(vote)
+                if loop.time() >= next_flush:
+                    await ws.send_str(json.dumps({"type": "vote_batch", "votes": pending}))
+                    pending = []
+                    next_flush = loop.time() + batch_linger
+            else:
+                vote["type"] = "remote_vote"
+                await ws.send_str(json.dumps(vote))
+            # Держим темп по абсолютному расписанию, а не по sleep после каждой отправки
+            delay = start + i * interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if pending:
+            await ws.send_str(json.dumps({"type": "vote_batch", "votes": pending}))
+
+
+async def run(args):
+    app = show.create_app()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    url = f"http://127.0.0.1:{args.port}/"
+
+    broadcaster = asyncio.create_task(show.vote_broadcaster(args.broadcast_hz))
+    vote_manager.reset_question()
+    vote_manager.set_voting_open(True)
+
+    rss_before = rss_mb()
+    # Голоса со всех источников нумеруются в порядке отправки — общий список
+    sent_at = []
+    counter = [0]
+
+    async with aiohttp.ClientSession() as session:
+        overlays = [Overlay() for _ in range(args.clients)]
+        overlay_tasks = [asyncio.create_task(o.run(session, url, sent_at)) for o in overlays]
+        while len(show.clients) < args.clients:
+            await asyncio.sleep(0.05)
+        print(f"🖥️ Подключено оверлеев: {len(show.clients)}")
+
+        per_source = args.rate / len(SOURCES)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            flood(session, url, src, per_source, args.duration, args.batch, sent_at, counter)
+            for src in SOURCES
+        ))
+        sent_elapsed = time.perf_counter() - t0
+
+        # Ждём, пока сервер разберёт хвост очереди
+        deadline = time.perf_counter() + 5
+        while len(vote_manager.votes) < counter[0] and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        accept_elapsed = time.perf_counter() - t0
+        await asyncio.sleep(2.0 / args.broadcast_hz)
+
+        dropped = sum(c.dropped for c in show.clients)
+        still_connected = len(show.clients)
+        for c in list(show.clients):
+            c.close()
+        await asyncio.gather(*overlay_tasks, return_exceptions=True)
+
+    broadcaster.cancel()
+    await runner.cleanup()
+
+    accepted = len(vote_manager.votes)
+    latencies = sorted(l for o in overlays for l in o.latencies)
+    frames = sum(o.frames for o in overlays)
+
+    print("\n=== Результаты ===")
+    print(f"Отправлено голосов:   {counter[0]} за {sent_elapsed:.1f} с ({counter[0] / sent_elapsed:.0f}/с)")
+    print(f"Принято голосов:      {accepted} ({accepted / accept_elapsed:.0f}/с)")
+    print(f"Задержка до оверлея:  p50 {percentile(latencies, 50) * 1000:.0f} мс, "
+          f"p95 {percentile(latencies, 95) * 1000:.0f} мс, p99 {percentile(latencies, 99) * 1000:.0f} мс, "
+          f"max {(latencies[-1] if latencies else 0) * 1000:.0f} мс")
+    print(f"Кадров получено:      {frames}, выброшено устаревших: {dropped}")
+    print(f"Оверлеев на связи:    {still_connected}/{args.clients}")
+    print(f"Память (max RSS):     {rss_before:.1f} → {rss_mb():.1f} МБ")
+    print(f"Дедупликация:         {vote_manager.get_dedup_stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест приёма голосов и рассылки оверлеям")
+    parser.add_argument("--clients", type=int, default=50, help="сколько оверлеев подключить")
+    parser.add_argument("--rate", type=float, default=1000, help="голосов в секунду на все источники")
+    parser.add_argument("--duration", type=float, default=10, help="сколько секунд флудить")
+    parser.add_argument("--batch", type=float, default=0, help="слать vote_batch раз в N секунд (0 = remote_vote)")
+    parser.add_argument("--broadcast-hz", type=float, default=show.VOTE_BROADCAST_HZ)
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,19 @@ import json
 import socket
 import urllib.request
 import os
+import random
+import threading
 import time
-import websockets
 import config
+import vote_manager
 
 from datetime import datetime
-from TikTokLive import TikTokLiveClient
-from TikTokLive.client.web.web_settings import WebDefaults
-from TikTokLive.events import CommentEvent
-from TikTokLive.client.errors import WebcastBlocked200Error
+
+# websockets нужен только для пересылки в отдельный процесс шоу (ws_sender)
+try:
+    import websockets
+except ImportError:
+    websockets = None
 
 # Пытаемся импортировать pytchat
 try:
@@ -22,6 +26,10 @@ except ImportError:
 
 try:
     from TikTokLive import TikTokLiveClient
+    try:
+        from TikTokLive.client.web.web_settings import WebDefaults
+    except ImportError:
+        WebDefaults = None
     try:
         from TikTokLive.events import CommentEvent
         from TikTokLive.client.errors import WebcastBlocked200Error
@@ -33,14 +41,22 @@ try:
             class WebcastBlocked200Error(Exception): pass
 except ImportError as e:
     TikTokLiveClient = None
+    WebDefaults = None
     class WebcastBlocked200Error(Exception): pass
     print(f"⚠️ Ошибка импорта TikTokLive: {e}")
     print("⚠️ TikTok чат будет отключен. (pip install TikTokLive)")
 
 PORT = os.environ.get("PORT", 8765)
-WS_URL = f"ws://127.0.0.1:{PORT}"
+# SHOW=<имя> — голоса уходят в это шоу (SHOWS / SHARD_PROCESSES в quiz_stream_show)
+SHOW = os.environ.get("SHOW", "")
+WS_URL = f"ws://127.0.0.1:{PORT}/?show={SHOW}" if SHOW else f"ws://127.0.0.1:{PORT}"
 msg_queue = asyncio.Queue()
 
+# Голоса уходят в шоу пачками (vote_batch): ждём до VOTE_BATCH_LINGER сек,
+# пока очередь наполнится, но не больше VOTE_BATCH_MAX голосов в пачке
+VOTE_BATCH_LINGER = float(os.environ.get("VOTE_BATCH_LINGER", 0.05))
+VOTE_BATCH_MAX = 500
+
 # ======================
 # КОНСТАНТЫ ДЛЯ TIKTOK
 # ======================
@@ -48,9 +64,94 @@ RECONNECT_BASE = 5       # базовая пауза между реконнек
 RECONNECT_MAX = 600      # макс пауза (10 мин)
 MAX_OFFLINE_RETRIES = 10
 CHECK_INTERVAL = 60      # интервал проверки офлайн стрима
+BACKOFF_JITTER = 0.2     # ±20% к паузам, чтобы реконнекты не шли строго в такт
+
+# ======================
+# КОНСТАНТЫ ДЛЯ YOUTUBE
+# ======================
+YOUTUBE_POLL_MIN = 0.5   # опрос при активном чате (сек)
+YOUTUBE_POLL_MAX = 5.0   # опрос при тишине в чате (сек)
+YOUTUBE_LOOKUP_TIMEOUT = 10
+_youtube_video_id = None  # последний найденный ID трансляции канала
+
+
+def enqueue_threadsafe(loop: asyncio.AbstractEventLoop, item: dict):
+    """Кладёт сообщение в msg_queue из любого потока (asyncio.Queue не потокобезопасна)"""
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        msg_queue.put_nowait(item)
+    else:
+        loop.call_soon_threadsafe(msg_queue.put_nowait, item)
+
+
+def _put_many(items):
+    for item in items:
+        msg_queue.put_nowait(item)
+
+
+def enqueue_batch_threadsafe(loop: asyncio.AbstractEventLoop, items: list):
+    """Пачка сообщений из рабочего потока — один call_soon_threadsafe на пачку"""
+    loop.call_soon_threadsafe(_put_many, items)
+
+
+# ======================
+# TWITCH IRC
+# ======================
+# Команды чата, которые шоу обрабатывает кроме ответов (см. quiz_stream_show.RANK_COMMAND)
+CHAT_COMMANDS = ("!rank",)
+# Самый длинный осмысленный голос — "!answer X"; всё длиннее отсеивается без разбора
+MAX_VOTE_LEN = 16
+
+
+def twitch_channels(value: str) -> list:
+    """IRC_CHANNEL="#a, b,#c" → ["#a", "#b", "#c"]"""
+    channels = []
+    for name in value.split(","):
+        name = name.strip().lower()
+        if name:
+            channels.append(name if name.startswith("#") else f"#{name}")
+    return channels
+
+
+def is_vote_candidate(text: str) -> bool:
+    """Дешёвый фильтр: в очередь идут только ответы и команды шоу"""
+    if len(text) > MAX_VOTE_LEN:
+        return False
+    return vote_manager.is_answer(text) or text.strip().lower() in CHAT_COMMANDS
+
+
+def parse_irc_tags(raw: str) -> dict:
+    tags = {}
+    for item in raw.split(";"):
+        key, _, value = item.partition("=")
+        tags[key] = value
+    return tags
+
+
+def parse_privmsg(line: str):
+    """
+    Разбирает строку IRC (с тегами IRCv3 или без) за пару split.
+    Возвращает (теги-строка, ник, канал, текст) для PRIVMSG, иначе None.
+    Теги не разбираются, пока сообщение не прошло фильтр голосов.
+    """
+    tags = ""
+    if line.startswith("@"):
+        tags, _, line = line.partition(" ")
+        tags = tags[1:]
+    parts = line.split(" ", 3)
+    if len(parts) < 4 or parts[1] != "PRIVMSG" or not parts[0].startswith(":"):
+        return None
+    prefix, _, channel, text = parts
+    nick = prefix[1:prefix.find("!")] if "!" in prefix else prefix[1:]
+    return tags, nick, channel, text[1:] if text.startswith(":") else text
+
 
 async def twitch_listener():
     print("🎮 Запуск слушателя Twitch...")
+    channels = twitch_channels(config.IRC_CHANNEL)
     while True:
         try:
             reader, writer = await asyncio.open_connection(config.IRC_SERVER, config.IRC_PORT)
@@ -59,89 +160,143 @@ async def twitch_listener():
                 writer.write(f"{s}\r\n".encode())
                 await writer.drain()
 
+            # Теги IRCv3: id сообщения и tmi-sent-ts с серверов Twitch
+            await send_line("CAP REQ :twitch.tv/tags")
             await send_line(f"PASS {config.IRC_TOKEN}")
             await send_line(f"NICK {config.IRC_NICK}")
-            await send_line(f"JOIN {config.IRC_CHANNEL}")
-            print("🎮 Twitch подключен")
+            # Несколько каналов — одной командой JOIN через запятую
+            await send_line(f"JOIN {','.join(channels)}")
+            print(f"🎮 Twitch подключен: {', '.join(channels)}")
 
+            skipped = 0
             while True:
                 raw = await reader.readline()
                 if not raw:
                     print("⚠️ Twitch соединение разорвано")
                     break
                 
-                line = raw.decode('utf-8', errors='ignore').strip()
+                line = raw.decode('utf-8', errors='ignore').rstrip("\r\n")
 
                 if line.startswith('PING'):
                     await send_line('PONG :tmi.twitch.tv')
                     continue
 
-                if 'PRIVMSG' not in line:
-                    continue
-
                 try:
-                    # Парсим сообщение
-                    parts = line.split(':', 2)
-                    if len(parts) < 3: continue
-                    
-                    username = line.split('!')[0][1:]
-                    message = parts[2].strip()
-                    
+                    parsed = parse_privmsg(line)
+                    if parsed is None:
+                        if " RECONNECT" in line:
+                            print("🔁 Twitch просит переподключиться")
+                            break
+                        continue
+
+                    tags, username, channel, message = parsed
+                    if not is_vote_candidate(message):
+                        skipped += 1
+                        continue
+
+                    tags = parse_irc_tags(tags) if tags else {}
+                    ts = tags.get("tmi-sent-ts")
                     # Отправляем в очередь для пересылки
                     await msg_queue.put({
                         "type": "remote_vote",
                         "source": "twitch",
+                        # По каналу шоу выбирается маршрут из SHOWS (quiz_stream_show)
+                        "channel": channel.lower(),
                         "username": username,
-                        "message": message,
-                        "timestamp": time.time()
+                        "message": message.strip(),
+                        "timestamp": int(ts) if ts else time.time(),
+                        "message_id": tags.get("id")
                     })
                 except Exception:
                     continue
+            writer.close()
+            if skipped:
+                print(f"🎮 Twitch: отфильтровано сообщений без голоса: {skipped}")
         except Exception as e:
             print(f"⚠️ Ошибка Twitch: {e}. Реконнект через 5с...")
             await asyncio.sleep(5)
+            continue
+        await asyncio.sleep(5)
+
+def resolve_youtube_video_id(channel_id: str):
+    """ID текущей трансляции канала по редиректу /live (блокирующий, вызывать в потоке)"""
+    url = f"https://www.youtube.com/channel/{channel_id}/live"
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(req, timeout=YOUTUBE_LOOKUP_TIMEOUT) as response:
+        final_url = response.geturl()
+        if "v=" in final_url:
+            return final_url.split("v=")[1].split("&")[0]
+    return None
+
+
+def poll_youtube_chat(video_id: str, loop: asyncio.AbstractEventLoop, stop: threading.Event) -> int:
+    """
+    Рабочий поток: опрашивает pytchat и передаёт сообщения пачками в msg_queue.
+    Интервал адаптивный: при потоке сообщений сокращается, в тишине растёт.
+    Возвращает число полученных сообщений.
+    """
+    # interruptable=False: pytchat не ставит обработчик сигналов (нельзя вне главного потока)
+    chat = pytchat.create(video_id=video_id, interruptable=False)
+    interval = YOUTUBE_POLL_MIN
+    received = 0
+    try:
+        while chat.is_alive() and not stop.is_set():
+            batch = [{
+                "type": "remote_vote",
+                "source": "youtube",
+                "username": c.author.name,
+                "message": c.message,
+                "timestamp": time.time(),
+                "message_id": c.id  # Добавляем ID сообщения
+            } for c in chat.get().sync_items()]
+            if batch:
+                enqueue_batch_threadsafe(loop, batch)
+                received += len(batch)
+                interval = max(YOUTUBE_POLL_MIN, interval / 2)
+            else:
+                interval = min(YOUTUBE_POLL_MAX, interval * 1.5)
+            stop.wait(interval)
+    finally:
+        chat.terminate()
+    return received
+
 
 async def youtube_listener():
+    global _youtube_video_id
     if not pytchat:
         return
     
     print("🔴 Запуск слушателя YouTube...")
+    loop = asyncio.get_running_loop()
     while True:
-        video_id = getattr(config, 'YOUTUBE_VIDEO_ID', None)
-        if not video_id:
-            channel_id = getattr(config, 'YOUTUBE_CHANNEL_ID', None)
-            if channel_id:
-                try:
-                    url = f"https://www.youtube.com/channel/{channel_id}/live"
-                    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-                    with urllib.request.urlopen(req) as response:
-                        final_url = response.geturl()
-                        if "v=" in final_url:
-                            video_id = final_url.split("v=")[1].split("&")[0]
-                except Exception:
-                    pass
+        video_id = getattr(config, 'YOUTUBE_VIDEO_ID', None) or _youtube_video_id
+        channel_id = getattr(config, 'YOUTUBE_CHANNEL_ID', None)
+        if not video_id and channel_id:
+            try:
+                video_id = await asyncio.to_thread(resolve_youtube_video_id, channel_id)
+            except Exception:
+                video_id = None
+            _youtube_video_id = video_id
         
         if not video_id:
             await asyncio.sleep(30)
             continue
 
         print(f"🔴 Подключение к YouTube ID: {video_id}")
+        stop = threading.Event()
+        received = 0
         try:
-            chat = pytchat.create(video_id=video_id)
-            while chat.is_alive():
-                for c in chat.get().sync_items():
-                    await msg_queue.put({
-                        "type": "remote_vote",
-                        "source": "youtube",
-                        "username": c.author.name,
-                        "message": c.message,
-                        "timestamp": time.time(),
-                        "message_id": c.id  # Добавляем ID сообщения
-                    })
-                await asyncio.sleep(1)
+            # pytchat синхронный — опрос в отдельном потоке, Twitch и TikTok не ждут
+            received = await asyncio.to_thread(poll_youtube_chat, video_id, loop, stop)
             print("🔴 YouTube чат отключился")
         except Exception as e:
             print(f"⚠️ Ошибка YouTube: {e}")
+        finally:
+            stop.set()
+
+        if not received and video_id == _youtube_video_id:
+            # Трансляция из кэша ничего не дала — в следующий раз ищем заново
+            _youtube_video_id = None
         
         await asyncio.sleep(10)
 
@@ -158,6 +313,41 @@ def is_stream_live(username: str) -> bool:
         return False
 
 
+async def is_stream_live_async(username: str) -> bool:
+    """is_stream_live в отдельном потоке — HTTP-проверка не блокирует event loop"""
+    return await asyncio.to_thread(is_stream_live, username)
+
+
+async def backoff(seconds: float):
+    """Неблокирующая пауза с джиттером: остальные чаты и ws_sender продолжают работать"""
+    await asyncio.sleep(seconds * random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER))
+
+
+async def run_tiktok_client(client):
+    """
+    Новые TikTokLive: client.connect() работает прямо в нашем event loop.
+    Старые умеют только блокирующий client.run() со своим loop — тогда
+    отдельный поток-демон, а голоса приходят через enqueue_threadsafe.
+    """
+    if hasattr(client, "connect"):
+        await client.connect()
+        return
+
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def worker():
+        try:
+            client.run()
+        except BaseException as e:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_exception(e))
+        else:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+    threading.Thread(target=worker, name="tiktok-client", daemon=True).start()
+    await done
+
+
 async def tiktok_listener():
     if not TikTokLiveClient:
         return
@@ -178,18 +368,19 @@ async def tiktok_listener():
     print(f"🎵 Запуск слушателя TikTok для @{tiktok_user}...")
     
     consecutive_offline = 0
+    loop = asyncio.get_running_loop()
     
     while True:
         # Проверяем статус стрима перед подключением
-        if not is_stream_live(tiktok_user):
+        if not await is_stream_live_async(tiktok_user):
             consecutive_offline += 1
             wait_time = min(RECONNECT_MAX, CHECK_INTERVAL * consecutive_offline)
             print(f"💤 Стрим @{tiktok_user} оффлайн, ждем {wait_time}s...")
-            time.sleep(wait_time)
+            await backoff(wait_time)
             
             if consecutive_offline > MAX_OFFLINE_RETRIES:
                 print("⚠️ Слишком много оффлайн попыток, пауза 10 минут...")
-                time.sleep(600)
+                await backoff(600)
                 consecutive_offline = 0
             continue
         
@@ -218,7 +409,8 @@ async def tiktok_listener():
                 time_str = datetime.fromtimestamp(ts).strftime("%H:%M:%S")
                 print(f"[{time_str}] [TikTok] {username}: {message}")
                 
-                await msg_queue.put({
+                # Обработчик может работать в потоке старого клиента — только так
+                enqueue_threadsafe(loop, {
                     "type": "remote_vote",
                     "source": "tiktok",
                     "username": username,
@@ -231,19 +423,17 @@ async def tiktok_listener():
             start_time = time.time()
             consecutive_offline = 0
             
-            # Запускаем клиент в отдельном потоке, чтобы избежать конфликта event loop
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, client.run)
+            await run_tiktok_client(client)
             
             # Если дошли сюда - стрим завершился
             duration = int(time.time() - start_time)
             print(f"📴 Стрим завершился, длительность: {duration}s")
-            time.sleep(RECONNECT_BASE)
+            await backoff(RECONNECT_BASE)
             
         except WebcastBlocked200Error:
             print("⛔ DEVICE_BLOCKED — пауза 5 минут")
             consecutive_offline = 0
-            time.sleep(300)
+            await backoff(300)
             
         except Exception as e:
             msg = str(e)
@@ -252,17 +442,17 @@ async def tiktok_listener():
             if "RATE_LIMIT" in msg or "rate_limit" in msg:
                 print("⏳ Rate limit достигнут. Пауза 10 минут...")
                 consecutive_offline = 0
-                time.sleep(600)
+                await backoff(600)
             elif "offline" in msg.lower():
                 consecutive_offline += 1
                 wait_time = min(RECONNECT_MAX, CHECK_INTERVAL * consecutive_offline)
                 print(f"💤 Оффлайн (попытка {consecutive_offline}). Пауза {wait_time}s...")
-                time.sleep(wait_time)
+                await backoff(wait_time)
             else:
                 consecutive_offline += 1
                 wait_time = min(RECONNECT_MAX, RECONNECT_BASE * (2 ** min(consecutive_offline, 7)))
                 print(f"🔁 Ошибка, ждём {wait_time}s...")
-                time.sleep(wait_time)
+                await backoff(wait_time)
 
 async def ws_sender():
     """Пересылает сообщения из очереди в основной скрипт через WebSocket"""
@@ -281,15 +471,43 @@ async def ws_sender():
                 reader_task = asyncio.create_task(reader())
                 try:
                     while True:
-                        data = await msg_queue.get()
-                        await ws.send(json.dumps(data))
-                        msg_queue.task_done()
+                        batch = await next_batch(msg_queue)
+                        if len(batch) == 1:
+                            payload = batch[0]
+                        else:
+                            for data in batch:
+                                data.pop("type", None)
+                            payload = {"type": "vote_batch", "votes": batch}
+                        try:
+                            await ws.send(json.dumps(payload))
+                        finally:
+                            for _ in batch:
+                                msg_queue.task_done()
                 finally:
                     reader_task.cancel()
         except Exception:
             await asyncio.sleep(3)
 
-async def main():
+async def next_batch(queue: asyncio.Queue, linger: float = VOTE_BATCH_LINGER, limit: int = VOTE_BATCH_MAX):
+    """Ждёт первое сообщение, затем добирает остальные не дольше linger секунд"""
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + linger
+    while len(batch) < limit:
+        if not queue.empty():
+            batch.append(queue.get_nowait())
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+def get_enabled_listeners():
+    """Корутины слушателей чатов, для которых есть настройки в config.py (env vars)"""
     print("\n--- Выбор сервисов для запуска ---")
 
     # Автоматическое определение на основе наличия настроек в config.py (env vars)
@@ -309,14 +527,20 @@ async def main():
 
     print("-" * 30)
 
-    tasks = [ws_sender()]
+    listeners = []
     if use_twitch:
-        tasks.append(twitch_listener())
+        listeners.append(twitch_listener())
     if use_youtube:
-        tasks.append(youtube_listener())
+        listeners.append(youtube_listener())
     if use_tiktok:
-        tasks.append(tiktok_listener())
-    await asyncio.gather(*tasks)
+        listeners.append(tiktok_listener())
+    return listeners
+
+async def main():
+    if not websockets:
+        print("Требуется пакет 'websockets'. Установите: pip install websockets")
+        return
+    await asyncio.gather(ws_sender(), *get_enabled_listeners())
 
 if __name__ == "__main__":
     try:
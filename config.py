@@ -5,7 +5,7 @@ IRC_SERVER = "irc.chat.twitch.tv"
 IRC_PORT = 6667
 IRC_NICK = os.environ.get("IRC_NICK", "turboquizde")
 IRC_TOKEN = os.environ.get("IRC_TOKEN", "")
-IRC_CHANNEL = os.environ.get("IRC_CHANNEL", "#turboquizde")
+IRC_CHANNEL = os.environ.get("IRC_CHANNEL", "#turboquizde")  # несколько каналов через запятую; шоу по каналу — SHOWS="a1:A1@#канал"
 
 #YouTube credentials
 YOUTUBE_VIDEO_ID = os.environ.get("YOUTUBE_VIDEO_ID", "")
@@ -17,4 +17,5 @@ TIKTOK_USERNAME = os.environ.get("TIKTOK_USERNAME", "")
 EULERSTREAM_API_KEY = os.environ.get("EULERSTREAM_API_KEY", "")
 
 # General settings
-BACKGROUND_MUSIC_URL = os.environ.get("BACKGROUND_MUSIC_URL", "")
\ No newline at end of file
+BACKGROUND_MUSIC_URL = os.environ.get("BACKGROUND_MUSIC_URL", "")
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")  # пусто = /admin/* отключены
\ No newline at end of file
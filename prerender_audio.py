@@ -0,0 +1,168 @@
+"""
+Офлайн-рендер озвучки для всего банка вопросов.
+
+Разбирает Deutsch_Quiz.txt так же, как это делает quiz_stream_show,
+генерирует клипы для каждого вопроса и варианта ответа и складывает их
+в аудиопакет (audio_pack/ + manifest.json). Повторный запуск
+перерисовывает только тексты, которых ещё нет в пакете.
+
+    python prerender_audio.py
+    python prerender_audio.py --concurrency 8 --out audio_pack
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import quiz_bank
+import tts_cache
+
+try:
+    import edge_tts
+except Exception:
+    edge_tts = None
+
+RETRIES = 3
+
+
+async def render_clip(text: str, voice: str) -> bytes:
+    communicate = edge_tts.Communicate(text, voice)
+    chunks = []
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            chunks.append(chunk["data"])
+    return b"".join(chunks)
+
+
+async def render_missing(texts, voice, out_dir, concurrency):
+    """Генерирует клипы с ограничением параллельности; возвращает {key: запись}"""
+    sem = asyncio.Semaphore(concurrency)
+    rendered = {}
+    done = 0
+
+    async def worker(text):
+        nonlocal done
+        key = tts_cache.clip_key(text, voice)
+        async with sem:
+            for attempt in range(1, RETRIES + 1):
+                try:
+                    data = await render_clip(text, voice)
+                    if data:
+                        break
+                except Exception as e:
+                    print(f"⚠️ Ошибка генерации ({attempt}/{RETRIES}): {text[:40]}… — {e}")
+                if attempt < RETRIES:
+                    await asyncio.sleep(attempt)
+            else:
+                return
+
+        filename = key + tts_cache.CLIP_EXT
+        tmp = os.path.join(out_dir, filename + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(out_dir, filename))
+
+        rendered[key] = _manifest_entry(text, filename, data)
+        done += 1
+        if done % 50 == 0:
+            print(f"🔊 Готово {done}/{len(texts)}")
+
+    await asyncio.gather(*(worker(t) for t in texts))
+    return rendered
+
+
+def _manifest_entry(text, filename, data):
+    return {
+        "text": text,
+        "file": filename,
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def _is_intact(out_dir, entry) -> bool:
+    try:
+        return os.path.getsize(os.path.join(out_dir, entry["file"])) == entry["size"]
+    except (OSError, KeyError):
+        return False
+
+
+def write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, tts_cache.PACK_MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+async def build_pack(quiz_file, out_dir, voice, concurrency, force=False):
+    quizzes = quiz_bank.load_bank(quiz_file)
+    texts = quiz_bank.speech_texts(quizzes)
+    print(f"Загружено квизов: {len(quizzes)}, текстов для озвучки: {len(texts)}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    old = tts_cache.load_pack_manifest(out_dir) or {}
+    old_clips = {} if force or old.get("voice") != voice else old.get("clips", {})
+
+    wanted = {tts_cache.clip_key(t, voice): t for t in texts}
+    clips = {k: e for k, e in old_clips.items() if k in wanted and _is_intact(out_dir, e)}
+    missing = [t for k, t in wanted.items() if k not in clips]
+    # Устаревшие считаем по всему старому пакету: при --force или смене голоса
+    # старые клипы иначе остались бы на диске без записи в манифесте
+    stale = [e for k, e in old.get("clips", {}).items() if k not in wanted]
+
+    print(f"📦 В пакете уже есть: {len(clips)}, нужно сгенерировать: {len(missing)}, устарело: {len(stale)}")
+
+    if missing:
+        if not edge_tts:
+            print("Требуется пакет 'edge-tts'. Установите: pip install edge-tts")
+            return 1
+        clips.update(await render_missing(missing, voice, out_dir, concurrency))
+
+    for entry in stale:
+        try:
+            os.remove(os.path.join(out_dir, entry["file"]))
+        except OSError:
+            pass
+
+    failed = len(wanted) - len(clips)
+    changed = bool(missing) or bool(stale) or not old
+    version = old.get("version", 0) + (1 if changed else 0)
+
+    with open(quiz_file, "rb") as f:
+        source_sha = hashlib.sha256(f.read()).hexdigest()
+
+    write_manifest(out_dir, {
+        "format": tts_cache.PACK_FORMAT,
+        "version": version,
+        "voice": voice,
+        "built_at": int(time.time()) if changed else old.get("built_at"),
+        "source": os.path.basename(quiz_file),
+        "source_sha256": source_sha,
+        "clips": clips,
+    })
+    print(f"✅ Аудиопакет v{version}: {len(clips)} клипов в {out_dir}")
+    if failed:
+        print(f"⚠️ Не удалось сгенерировать {failed} клипов — запустите ещё раз")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пререндер озвучки всего банка вопросов")
+    parser.add_argument("--quiz-file", default="Deutsch_Quiz.txt")
+    parser.add_argument("--out", default=tts_cache.PACK_DIR)
+    parser.add_argument("--voice", default=tts_cache.DEFAULT_VOICE)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--force", action="store_true", help="перегенерировать всё")
+    args = parser.parse_args()
+
+    return asyncio.run(build_pack(
+        args.quiz_file, args.out, args.voice, max(1, args.concurrency), args.force
+    ))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,359 @@
+import hashlib
+import json
+import os
+import random
+import re
+from typing import Dict, List, Optional, Tuple
+
+# ---------------- CONFIG ----------------
+
+QUIZ_SEPARATOR = "\n\n⏳ Antworte im Chat!\n\n"
+QUIZ_TRAILER = "⏳ Antworte im Chat!"
+
+# Скомпилированный банк лежит рядом с исходником: Deutsch_Quiz.txt.compiled.json
+COMPILED_SUFFIX = ".compiled.json"
+COMPILED_FORMAT = 2
+
+_OPTION_RE = re.compile(r'^([A-D])\)\s*(.*)$', re.IGNORECASE)
+_CORRECT_RE = re.compile(r'^([A-Z])\)\s*(.*)$')
+# Уровень: строка "Niveau: A1" / "Level: A1" или метка в теме "Thema: Geographie (A1)"
+_LEVEL_LINE_RE = re.compile(r'^(?:Niveau|Level):\s*(\S+)', re.IGNORECASE)
+_LEVEL_RE = re.compile(r'\b([ABC][12])\b', re.IGNORECASE)
+
+
+class Quiz:
+    """Один вопрос банка, разобранный один раз при загрузке"""
+
+    __slots__ = ("topic", "level", "question", "options", "correct_letter", "correct_text")
+
+    def __init__(self, topic: str, level: str, question: str, options: Tuple[str, ...],
+                 correct_letter: Optional[str], correct_text: str):
+        self.topic = topic                    # "Geographie" (без "Thema:")
+        self.level = level                    # "A1" или "", если не указан
+        self.question = question
+        self.options = options                # ("A) Die Elbe", "B) Der Rhein", ...)
+        self.correct_letter = correct_letter  # "B" или None, если формат другой
+        self.correct_text = correct_text      # "Der Rhein"
+
+    @property
+    def text(self) -> str:
+        """Текст вопроса для оверлея — без строки с правильным ответом"""
+        lines = [f"Thema: {self.topic}"] if self.topic else []
+        lines.append(self.question)
+        lines.extend(self.options)
+        return "\n".join(lines)
+
+    def to_row(self) -> list:
+        return [self.topic, self.level, self.question, list(self.options),
+                self.correct_letter, self.correct_text]
+
+    @classmethod
+    def from_row(cls, row) -> "Quiz":
+        topic, level, question, options, letter, correct = row
+        return cls(topic, level, question, tuple(options), letter, correct)
+
+    @property
+    def key(self) -> tuple:
+        """Идентичность вопроса при перезагрузке банка: изменился текст — новый вопрос"""
+        return (self.topic, self.level, self.question, self.options,
+                self.correct_letter, self.correct_text)
+
+    def __repr__(self):
+        return f"Quiz({self.topic!r}, {self.question!r}, correct={self.correct_letter!r})"
+
+
+# ---------------- PARSING ----------------
+
+def split_blocks(content: str) -> List[str]:
+    """Режет текст файла на блоки по разделителю '⏳ Antworte im Chat!'"""
+    blocks = content.strip().split(QUIZ_SEPARATOR)
+    if blocks and blocks[-1].endswith(QUIZ_TRAILER):
+        blocks[-1] = blocks[-1][:-len(QUIZ_TRAILER)]
+    return [b.strip() for b in blocks if b.strip()]
+
+
+def parse_quiz(block: str) -> Tuple[Optional[Quiz], List[str]]:
+    """Разбирает один блок. Возвращает (квиз или None, список замечаний)"""
+    problems = []
+    topic = ""
+    level = ""
+    question = ""
+    options = []
+    correct_lines = []
+
+    for raw in block.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if "✅" in line:
+            correct_lines.append(line.replace("✅", "").strip())
+        elif line.startswith("Thema:"):
+            topic = line[len("Thema:"):].strip()
+        elif _LEVEL_LINE_RE.match(line):
+            level = _LEVEL_LINE_RE.match(line).group(1).upper()
+        elif _OPTION_RE.match(line):
+            options.append(line)
+        elif not question:
+            question = line
+        else:
+            problems.append(f"лишняя строка: {line!r}")
+
+    if not question:
+        return None, problems + ["нет текста вопроса"]
+    if len(options) < 2:
+        return None, problems + [f"вариантов ответа: {len(options)}"]
+    if not correct_lines:
+        return None, problems + ["нет строки с ✅"]
+    if len(correct_lines) > 1:
+        problems.append(f"несколько строк с ✅ ({len(correct_lines)}), берём первую")
+
+    letters = [_OPTION_RE.match(o).group(1).upper() for o in options]
+    if len(set(letters)) != len(letters):
+        problems.append(f"повторяются буквы вариантов: {''.join(letters)}")
+
+    correct_letter = None
+    m = _CORRECT_RE.match(correct_lines[0])
+    if m:
+        correct_letter = m.group(1)
+        correct_text = m.group(2).strip()
+        if correct_letter not in letters:
+            problems.append(f"правильный ответ {correct_letter}) не среди вариантов")
+    else:
+        # если формат другой — используем весь текст как правильный ответ
+        correct_text = correct_lines[0]
+        problems.append("у правильного ответа нет буквы")
+
+    if not level:
+        m = _LEVEL_RE.search(topic)
+        if m:
+            level = m.group(1).upper()
+
+    return Quiz(topic, level, question, tuple(options), correct_letter, correct_text), problems
+
+
+def parse_quizzes(content: str, memo: Optional[dict] = None) -> Tuple[List[Quiz], List[str]]:
+    """Разбирает весь файл; битые блоки пропускаются и попадают в список ошибок.
+
+    memo (блок -> результат разбора) позволяет при перезагрузке разбирать
+    только изменившиеся блоки; после вызова в нём остаются только актуальные.
+    """
+    quizzes = []
+    errors = []
+    fresh = {}
+    for n, block in enumerate(split_blocks(content), 1):
+        parsed = memo.get(block) if memo is not None else None
+        if parsed is None:
+            parsed = parse_quiz(block)
+        fresh[block] = parsed
+        quiz, problems = parsed
+        if problems:
+            first = block.splitlines()[1] if "\n" in block else block
+            errors.append(f"#{n} ({first[:50]}): {'; '.join(problems)}" + ("" if quiz else " — пропущен"))
+        if quiz:
+            quizzes.append(quiz)
+    if memo is not None:
+        memo.clear()
+        memo.update(fresh)
+    return quizzes, errors
+
+
+def diff_banks(old: List[Quiz], new: List[Quiz]) -> Tuple[int, int, int]:
+    """(добавлено, удалено, без изменений) — по идентичности вопросов"""
+    old_keys = {q.key for q in old}
+    new_keys = {q.key for q in new}
+    return len(new_keys - old_keys), len(old_keys - new_keys), len(old_keys & new_keys)
+
+
+# ---------------- INDEX ----------------
+
+class ShuffleBag:
+    """Случайный порядок без повторов: draw() за O(1), после опустошения — новая перетасовка"""
+
+    __slots__ = ("items", "pending", "last")
+
+    def __init__(self, items: List[int]):
+        self.items = list(items)
+        self.pending: List[int] = []
+        self.last: Optional[int] = None
+        self._refill()
+
+    @property
+    def drawn(self) -> int:
+        """Сколько вопросов уже показано в текущем круге"""
+        return len(self.items) - len(self.pending)
+
+    def _refill(self):
+        if self.last is not None:
+            print("Все вопросы показаны. Сбрасываем историю...")
+        self.pending = self.items[:]
+        random.shuffle(self.pending)
+        # Не начинаем новый круг с только что показанного вопроса
+        if len(self.pending) > 1 and self.pending[-1] == self.last:
+            self.pending[0], self.pending[-1] = self.pending[-1], self.pending[0]
+
+    def peek(self) -> int:
+        """Следующий индекс без извлечения (для предзагрузки озвучки)"""
+        if not self.pending:
+            self._refill()
+        return self.pending[-1]
+
+    def draw(self) -> int:
+        if not self.pending:
+            self._refill()
+        self.last = self.pending.pop()
+        return self.last
+
+
+class QuizIndex:
+    """Инвертированный индекс банка по теме и уровню + по одному ShuffleBag на фильтр"""
+
+    def __init__(self, quizzes: List[Quiz]):
+        self.quizzes = quizzes
+        self.by_topic: Dict[str, List[int]] = {}
+        self.by_level: Dict[str, List[int]] = {}
+        for i, q in enumerate(quizzes):
+            if q.topic:
+                self.by_topic.setdefault(q.topic.lower(), []).append(i)
+            if q.level:
+                self.by_level.setdefault(q.level, []).append(i)
+        self._bags: Dict[Optional[str], ShuffleBag] = {}
+
+    def candidates(self, quiz_filter: Optional[str]) -> List[int]:
+        """Индексы под фильтр: 'Thema: Geographie', 'Geographie', 'A1' или любая подстрока"""
+        if not quiz_filter:
+            return list(range(len(self.quizzes)))
+
+        f = quiz_filter.strip()
+        if f.startswith("Thema:"):
+            found = self.by_topic.get(f[len("Thema:"):].strip().lower())
+        elif f.upper() in self.by_level:
+            found = self.by_level[f.upper()]
+        else:
+            found = self.by_topic.get(f.lower())
+        if not found:
+            # Нет точной темы/уровня (например, 'Thema: Kultur') — полный проход по
+            # подстроке, но один раз на фильтр
+            found = [i for i, q in enumerate(self.quizzes) if f in q.text]
+
+        if not found:
+            print(f"Фильтр '{quiz_filter}' не дал совпадений. Будут использованы все квизы.")
+            return list(range(len(self.quizzes)))
+        return found
+
+    def picker(self, quiz_filter: Optional[str]) -> ShuffleBag:
+        bag = self._bags.get(quiz_filter)
+        if bag is None:
+            bag = self._bags[quiz_filter] = ShuffleBag(self.candidates(quiz_filter))
+        return bag
+
+    def adopt_history(self, old: "QuizIndex"):
+        """Переносит историю показов из старого индекса после перезагрузки банка.
+
+        Неизменившиеся вопросы, уже показанные в текущем круге, остаются
+        показанными; новые и изменённые попадают в ещё не показанные.
+        """
+        for quiz_filter, old_bag in old._bags.items():
+            pending_keys = {old.quizzes[i].key for i in old_bag.pending}
+            known_keys = {old.quizzes[i].key for i in old_bag.items}
+            bag = self.picker(quiz_filter)
+            bag.pending = [
+                i for i in bag.items
+                if self.quizzes[i].key in pending_keys or self.quizzes[i].key not in known_keys
+            ]
+            random.shuffle(bag.pending)
+            if old_bag.last is not None:
+                last_key = old.quizzes[old_bag.last].key
+                bag.last = next((i for i in bag.items if self.quizzes[i].key == last_key), None)
+
+
+# ---------------- LOADING ----------------
+
+def load_bank(path: str, use_cache: bool = True) -> List[Quiz]:
+    """Загружает банк вопросов, по возможности из скомпилированного файла.
+
+    Скомпилированный файл используется, только если совпадают mtime и размер
+    исходника, либо (если mtime поменялся) его sha256.
+    """
+    st = os.stat(path)
+    cache_path = path + COMPILED_SUFFIX
+    cached = _read_compiled(cache_path) if use_cache else None
+
+    if cached and cached["source_mtime"] == st.st_mtime_ns and cached["source_size"] == st.st_size:
+        _report_errors(path, cached.get("errors", []))
+        return _from_compiled(cached)
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    sha = hashlib.sha256(raw).hexdigest()
+
+    if cached and cached["source_sha256"] == sha:
+        quizzes = _from_compiled(cached)
+        errors = cached.get("errors", [])
+    else:
+        quizzes, errors = parse_quizzes(raw.decode("utf-8"))
+    _report_errors(path, errors)
+
+    if use_cache:
+        _write_compiled(cache_path, {
+            "format": COMPILED_FORMAT,
+            "source_mtime": st.st_mtime_ns,
+            "source_size": st.st_size,
+            "source_sha256": sha,
+            "errors": errors,
+            "quizzes": [q.to_row() for q in quizzes],
+        })
+    return quizzes
+
+
+def reload_bank(path: str, memo: dict) -> Tuple[List[Quiz], List[str]]:
+    """Перечитывает банк после изменения файла, разбирая только новые блоки"""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    quizzes, errors = parse_quizzes(content, memo)
+    _report_errors(path, errors)
+    return quizzes, errors
+
+
+def speech_texts(quizzes) -> List[str]:
+    """Все уникальные тексты для озвучки (вопросы и варианты) в порядке появления"""
+    seen = set()
+    texts = []
+    for quiz in quizzes:
+        for text in (quiz.question, *quiz.options):
+            if text and text not in seen:
+                seen.add(text)
+                texts.append(text)
+    return texts
+
+
+def _report_errors(path: str, errors: List[str]):
+    if not errors:
+        return
+    print(f"⚠️ {os.path.basename(path)}: проблемных вопросов: {len(errors)}")
+    for e in errors:
+        print(f"   {e}")
+
+
+def _from_compiled(data: dict) -> List[Quiz]:
+    return [Quiz.from_row(row) for row in data["quizzes"]]
+
+
+def _read_compiled(cache_path: str) -> Optional[dict]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("format") != COMPILED_FORMAT:
+        return None
+    return data
+
+
+def _write_compiled(cache_path: str, data: dict):
+    tmp = cache_path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить скомпилированный банк: {e}")
@@ -1,13 +1,17 @@
 import asyncio
-import random
 import json
-import re
 import urllib.request
 import config
 import vote_manager
+import tts_cache
+import quiz_bank
 import io
 import os
-from aiohttp import web, WSMsgType
+import signal
+import sys
+import time
+from collections import deque
+from aiohttp import web, WSMsgType, ClientSession, ClientError
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "1"
 
 try:
@@ -33,85 +37,299 @@ ALL_QUIZZES_FILE = "Deutsch_Quiz.txt"
 OUTPUT_FILE = "quiz.txt"
 ANSWER_FILE = "answer.txt"    # файл для правильного ответа
 QUIZ_INTERVAL = 60            # время между вопросами
-ANSWER_DELAY = 50             # время до показа правильного ответа
-TIMER_START = ANSWER_DELAY    # таймер обратного отсчёта
+ANSWER_DELAY = 50             # время до показа правильного ответа (обратный отсчёт)
 
 # Установите в None чтобы показывать все квизы,
-# или в строку, например 'A1' или 'Thema: Geographie' чтобы фильтровать
-QUIZ_FILTER = None
+# или в строку, например 'A1' или 'Thema: Geographie' чтобы фильтровать.
+# Можно менять на ходу через /admin/filter (см. set_quiz_filter)
+QUIZ_FILTER = os.environ.get("QUIZ_FILTER") or None
+
+# Потоковая озвучка: ссылка на клип уходит в браузер сразу после первого
+# чанка Edge TTS, а /audio/<hash> отдаёт чанки по мере генерации
+TTS_STREAMING = os.environ.get("TTS_STREAMING", "1") != "0"
+# Сколько клипов Edge TTS генерирует одновременно (вопрос + 4 варианта = 5)
+TTS_CONCURRENCY = max(1, int(os.environ.get("TTS_CONCURRENCY", 5)))
 
 # -------------------------------
 # Загрузка квизов
 # -------------------------------
-with open(ALL_QUIZZES_FILE, "r", encoding="utf-8") as f:
-    content = f.read()
+def quiz_file_signature():
+    """(mtime, размер) файла с квизами или None, если его нет"""
+    try:
+        st = os.stat(ALL_QUIZZES_FILE)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
 
-all_quizzes = content.strip().split("\n\n⏳ Antworte im Chat!\n\n")
-all_quizzes = [q.strip() for q in all_quizzes if q.strip()]
+# Снимок файла берём до загрузки: правка во время старта тоже будет подхвачена
+quiz_file_seen = quiz_file_signature()
+# Разбор блоков файла по версиям: заполняется первой перезагрузкой (старт идёт
+# из скомпилированного файла без разбора), дальше разбираются только изменённые
+quiz_memo = {}
+all_quizzes = quiz_bank.load_bank(ALL_QUIZZES_FILE)
+quiz_index = quiz_bank.QuizIndex(all_quizzes)
 print(f"Загружено квизов: {len(all_quizzes)}")
 
-used_indices = set()
+# Как часто проверять, не изменился ли файл с квизами (0 = не следить)
+QUIZ_RELOAD_INTERVAL = float(os.environ.get("QUIZ_RELOAD_INTERVAL", 5))
 
 # -------------------------------
 # WebSocket clients
 # -------------------------------
 WS_HOST = "0.0.0.0"
 WS_PORT = int(os.environ.get("PORT", 8765))
-clients = set()
 
-# vote state now in vote_manager
+# Очередь исходящих сообщений на клиента: сколько обязательных сообщений
+# может ждать отправки и сколько секунд может идти одна отправка
+CLIENT_QUEUE_DEPTH = int(os.environ.get("CLIENT_QUEUE_DEPTH", 64))
+CLIENT_SEND_TIMEOUT = float(os.environ.get("CLIENT_SEND_TIMEOUT", 10))
+
+# Для этих типов важно только последнее состояние — старое можно выбросить
+# (оверлей показывает лишь последний ответ на !rank)
+DROPPABLE_KINDS = ("phase", "votes", "rank")
+
+
+class ClientConnection:
+    """WebSocket-клиент с ограниченной очередью и одной задачей-отправителем"""
+
+    __slots__ = ("ws", "group", "queue", "pending_latest", "stale", "wakeup", "writer", "dropped", "closed")
+
+    def __init__(self, ws, group: set):
+        self.ws = ws
+        self.group = group            # clients шоу, к которому подключён клиент
+        self.queue = deque()          # [kind, msg] в порядке отправки
+        self.pending_latest = {}      # kind -> ещё не отправленная запись из queue
+        self.stale = 0                # записей в queue, вытесненных более новым состоянием
+        self.wakeup = asyncio.Event()
+        self.writer = None
+        self.dropped = 0              # сколько устаревших timer/votes заменено новыми
+        self.closed = False
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def send(self, msg: str, kind: str = None):
+        if self.closed:
+            return
+        if kind in DROPPABLE_KINDS:
+            entry = self.pending_latest.get(kind)
+            if entry is not None:
+                self.dropped += 1
+                if self.queue[-1] is entry:
+                    # Позади никого — заменяем на месте
+                    entry[1] = msg
+                    return
+                # Старое состояние помечаем устаревшим (писатель его пропустит), а новое
+                # ставим в конец: оно не должно обогнать question/answer, вставшие позже
+                entry[1] = None
+                self.stale += 1
+            entry = [kind, msg]
+            self.pending_latest[kind] = entry
+            self.queue.append(entry)
+        else:
+            if len(self.queue) - self.stale >= CLIENT_QUEUE_DEPTH:
+                print(f"⚠️ Клиент не успевает принимать сообщения ({len(self.queue)} в очереди) — отключаем")
+                self.close()
+                return
+            self.queue.append([kind, msg])
+        self.wakeup.set()
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                entry = self.queue.popleft()
+                if entry[1] is None:
+                    self.stale -= 1
+                    continue
+                if self.pending_latest.get(entry[0]) is entry:
+                    del self.pending_latest[entry[0]]
+                await asyncio.wait_for(self.ws.send_str(entry[1]), CLIENT_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("⚠️ Клиент завис на отправке — отключаем")
+            self.close()
+        except Exception:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.pending_latest.clear()
+        self.stale = 0
+        self.wakeup.set()
+        self.group.discard(self)
+        if not self.ws.closed:
+            _spawn_background(self.ws.close())
+
+
+# -------------------------------
+# Шоу: несколько независимых викторин в одном процессе
+# -------------------------------
+# SHOWS="a1:A1,b2:B2" — имена шоу и их фильтры квизов; без SHOWS одно шоу
+# "main" с QUIZ_FILTER. Клиент выбирает шоу путём /show/<имя> или ?show=<имя>.
+# Голоса из чатов направляются по маршрутам после '@': канал Twitch или
+# источник целиком — SHOWS="a1:A1@#chan_a,b2:B2@#chan_b@youtube". Каналы
+# должны быть и в IRC_CHANNEL; голоса без маршрута уходят в первое шоу.
+DEFAULT_SHOW = "main"
+SHOWS_SPEC = os.environ.get("SHOWS", "")
+# В процессе-шарде шоу не главное: answer.txt и локальный звук — у первого шарда
+SHOW_PRIMARY = os.environ.get("SHOW_PRIMARY", "1") != "0"
+
+
+class Show:
+    """Одно шоу: свой круг вопросов, голосование, таймер и группа клиентов"""
+
+    def __init__(self, name: str, quiz_filter: str = None, primary: bool = False, routes=()):
+        self.name = name
+        self.quiz_filter = quiz_filter or None
+        self.routes = tuple(routes)   # "#канал" Twitch или имя источника
+        # Главное шоу пишет answer.txt и играет звук локально
+        self.primary = primary
+        self.index = quiz_index if primary else quiz_bank.QuizIndex(all_quizzes)
+        self.votes = vote_manager.default_state if primary else vote_manager.VoteState(name)
+        self.clients = set()          # ClientConnection
+        self.current_phase = None     # (имя фазы, дедлайн в loop.time())
+        self.votes_sent_version = None
+        self.rank_sent_at = float("-inf")   # время последнего ответа на !rank
+
+    def picker(self):
+        # У каждого фильтра свой ShuffleBag: выбор за O(1), без повторов до конца круга
+        return self.index.picker(self.quiz_filter)
+
+
+def parse_shows(spec: str):
+    """'a1:A1@#chan_a, b2:B2@youtube' -> [("a1", "A1", ["#chan_a"]), ("b2", "B2", ["youtube"])]"""
+    result = []
+    for item in spec.split(","):
+        head, *routes = item.split("@")
+        name, _, quiz_filter = head.partition(":")
+        name = name.strip().lower()
+        if name:
+            routes = [r.strip().lower() for r in routes if r.strip()]
+            result.append((name, quiz_filter.strip() or None, routes))
+    return result
+
+
+def format_show(show: Show) -> str:
+    """Обратно в запись SHOWS — для процесса-шарда"""
+    return "@".join([f"{show.name}:{show.quiz_filter or ''}", *show.routes])
+
+
+def _build_shows():
+    specs = parse_shows(SHOWS_SPEC) or [(DEFAULT_SHOW, QUIZ_FILTER, [])]
+    return {
+        name: Show(name, quiz_filter, primary=(i == 0 and SHOW_PRIMARY), routes=routes)
+        for i, (name, quiz_filter, routes) in enumerate(specs)
+    }
+
+
+shows = _build_shows()
+default_show = next(iter(shows.values()))
+clients = default_show.clients   # клиенты шоу по умолчанию
+# маршрут ("#канал" или источник) -> шоу
+show_routes = {route: show for show in shows.values() for route in show.routes}
+
+
+def show_requested(request) -> bool:
+    return bool(request.match_info.get("show") or request.query.get("show"))
+
+
+def show_for_vote(data: dict) -> Show:
+    """Шоу для голоса из чата: по каналу Twitch, затем по источнику, иначе первое"""
+    channel = data.get("channel")
+    if channel:
+        show = show_routes.get(str(channel).lower())
+        if show is not None:
+            return show
+    return show_routes.get(str(data.get("source", "")).lower(), default_show)
+
+
+def route_votes(batch: list) -> dict:
+    """Раскладывает пачку голосов по шоу: {Show: [голоса]}"""
+    if not show_routes:
+        return {default_show: batch}
+    routed = {}
+    for data in batch:
+        if isinstance(data, dict):
+            routed.setdefault(show_for_vote(data), []).append(data)
+    return routed
+
+
+def show_for_request(request):
+    """Шоу по /show/<имя> или ?show=<имя>; без указания — по умолчанию, неизвестное — None"""
+    name = request.match_info.get("show") or request.query.get("show")
+    if not name:
+        return default_show
+    return shows.get(name.lower())
+
 
 async def handle_all(request):
+    show = show_for_request(request)
+    if show is None:
+        return web.Response(text="Show not found", status=404)
+
     # 1. Если это WebSocket запрос — подключаем клиента
     if request.headers.get("Upgrade", "").lower() == "websocket":
         ws = web.WebSocketResponse()
         await ws.prepare(request)
         
-        clients.add(ws)
+        conn = ClientConnection(ws, show.clients)
+        show.clients.add(conn)
+        conn.start()
         
         # Отправляем команду на запуск музыки при подключении (для браузера)
         music_url = os.environ.get("BACKGROUND_MUSIC_URL")
         if music_url:
-            try:
-                await ws.send_json({
-                    "type": "music",
-                    "url": music_url,
-                    "volume": 0.3,
-                    "loop": True
-                })
-            except Exception:
-                pass
+            conn.send(json.dumps({
+                "type": "music",
+                "url": music_url,
+                "volume": 0.3,
+                "loop": True
+            }))
+
+        # Голоса рассылаются только при изменениях — новому клиенту шлём текущее состояние
+        conn.send(votes_payload(show), kind="votes")
+        if show.current_phase:
+            conn.send(phase_payload(*show.current_phase), kind="phase")
 
+        # Клиент без явного шоу (chat_listener.py без SHOW) — голоса по маршрутам SHOWS
+        explicit = show_requested(request)
         try:
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
                     try:
                         data = json.loads(msg.data)
-                        if data.get("type") == "remote_vote":
-                            source = data.get("source", "unknown")
-                            username = data.get("username")
-                            msg_text = data.get("message")
-                            message_id = data.get("message_id")  # ← Добавить эту строку
-                            timestamp = data.get("timestamp")
-                            accepted = vote_manager.accept_vote(source, username, msg_text, timestamp, message_id)
-                            if accepted:
-                                print(f"✅ [{source}] {username} → {msg_text}")
-                                await broadcast_votes_once()
+                        kind = data.get("type")
+                        if kind == "vote_batch":
+                            votes = data.get("votes") or []
+                            if explicit:
+                                await handle_vote_batch(votes, show)
+                            else:
+                                await dispatch_votes(votes)
+                        elif kind == "remote_vote":
+                            await handle_remote_vote(data, show if explicit else show_for_vote(data))
                     except Exception:
                         pass
         finally:
-            clients.remove(ws)
+            conn.close()
+            if conn.writer:
+                conn.writer.cancel()
         return ws
 
     # 2. Если это обычный HTTP запрос — отдаем файлы
     path = request.path
-    if path == "/":
+    if path == "/" or (path.startswith("/show/") and not path.endswith("/mobile")):
         try:
             with open("quiz-overlay.html", "rb") as f:
                 return web.Response(body=f.read(), content_type="text/html")
         except FileNotFoundError:
             return web.Response(text="quiz-overlay.html not found", status=404)
-    elif path == "/mobile":
+    elif path.endswith("/mobile"):
         try:
             with open("quiz-overlay-mobile.html", "rb") as f:
                 return web.Response(body=f.read(), content_type="text/html")
@@ -122,37 +340,211 @@ async def handle_all(request):
     
     return web.Response(text="Not Found", status=404)
 
-async def broadcast(msg: str):
-    if not clients:
+async def handle_admin_filter(request):
+    """GET /admin/filter?token=...&value=A1[&show=b2] — смена фильтра шоу без перезапуска"""
+    admin_token = getattr(config, 'ADMIN_TOKEN', None)
+    if not admin_token or request.query.get("token") != admin_token:
+        return web.Response(text="Forbidden", status=403)
+
+    show = show_for_request(request)
+    if show is None:
+        return web.Response(text="Show not found", status=404)
+    if "value" in request.query:
+        set_quiz_filter(request.query.get("value"), show)
+    picker = show.picker()
+    return web.json_response({
+        "show": show.name, "filter": show.quiz_filter,
+        "total": len(picker.items), "current": picker.drawn,
+    })
+
+async def handle_audio(request):
+    """Отдаёт TTS-клип по контентному ключу; клип с таким ключом никогда не меняется"""
+    name = request.match_info.get("name", "")
+    key = name[:-len(tts_cache.CLIP_EXT)] if name.endswith(tts_cache.CLIP_EXT) else name
+    if not tts_cache.is_valid_key(key):
+        return web.Response(text="Not Found", status=404)
+
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Access-Control-Allow-Origin": "*",
+    }
+    if_none_match = request.if_none_match or ()
+    if any(etag.value in (key, "*") for etag in if_none_match):
+        resp = web.Response(status=304, headers=headers)
+        resp.etag = key
+        return resp
+
+    clip = tts_cache.get_by_key(key)
+    if clip is None:
+        stream = _tts_streams.get(key)
+        if stream is not None:
+            return await _stream_audio(request, stream)
+        return web.Response(text="Not Found", status=404)
+
+    resp = web.Response(body=clip.data, content_type="audio/mpeg", headers=headers)
+    resp.etag = key
+    return resp
+
+async def _stream_audio(request, stream):
+    """Отдаёт клип, который ещё генерируется, чанками по порядку"""
+    resp = web.StreamResponse(headers={
+        "Content-Type": "audio/mpeg",
+        # Незаконченный клип не кэшируем: при сбое генерации он будет обрезан
+        "Cache-Control": "no-store",
+        "Access-Control-Allow-Origin": "*",
+    })
+    resp.enable_chunked_encoding()
+    await resp.prepare(request)
+    try:
+        async for data in stream.iter_chunks():
+            await resp.write(data)
+        await resp.write_eof()
+    except ConnectionResetError:
+        pass
+    return resp
+
+RANK_COMMAND = "!rank"
+RANK_COOLDOWN = 30          # секунд между запросами !rank от одного зрителя
+# Общий потолок на шоу: при рейде !rank отвечаем не чаще раза в RANK_MIN_INTERVAL
+RANK_MIN_INTERVAL = float(os.environ.get("RANK_MIN_INTERVAL", 1.0))
+_rank_requested = {}        # username -> время последнего запроса
+
+async def handle_rank_request(source: str, username: str, show: Show = None):
+    """Ответ на '!rank' из чата: место и очки зрителя показываются в оверлее"""
+    show = show or default_show
+    now = time.monotonic()
+    if now - _rank_requested.get(username, -RANK_COOLDOWN) < RANK_COOLDOWN:
+        return
+    if now - show.rank_sent_at < RANK_MIN_INTERVAL:
+        return
+    show.rank_sent_at = now
+    _rank_requested[username] = now
+    if len(_rank_requested) > 5000:
+        for u, t in list(_rank_requested.items()):
+            if now - t >= RANK_COOLDOWN:
+                del _rank_requested[u]
+
+    info = await vote_manager.get_rank_async(username)
+    if info is None:
+        info = {"username": username, "rank": None, "score": 0}
+    await broadcast(json.dumps({"type": "rank", "source": source, **info}), kind="rank", show=show)
+
+async def handle_remote_vote(data: dict, show: Show = None):
+    """Голос из чата — по WebSocket от chat_listener.py или напрямую из очереди"""
+    show = show or default_show
+    source = data.get("source", "unknown")
+    username = data.get("username")
+    msg_text = data.get("message")
+    if username and isinstance(msg_text, str) and msg_text.strip().lower() == RANK_COMMAND:
+        await handle_rank_request(source, username, show)
         return
+    message_id = data.get("message_id")
+    timestamp = data.get("timestamp")
+    accepted = vote_manager.accept_vote(source, username, msg_text, timestamp, message_id, state=show.votes)
+    if accepted:
+        # Рассылку делает vote_broadcaster — не чаще VOTE_BROADCAST_HZ раз в секунду
+        print(f"✅ [{source}] {username} → {msg_text}")
+
+async def handle_vote_batch(batch: list, show: Show = None):
+    """Пачка голосов (vote_batch) — принимается одним вызовом vote_manager.accept_votes"""
+    show = show or default_show
+    votes = []
+    for data in batch:
+        if not isinstance(data, dict):
+            continue
+        msg_text = data.get("message")
+        if isinstance(msg_text, str) and msg_text.strip().lower() == RANK_COMMAND:
+            if data.get("username"):
+                await handle_rank_request(data.get("source", "unknown"), data["username"], show)
+        else:
+            votes.append(data)
+    accepted = vote_manager.accept_votes(votes, show.votes)
+    if accepted:
+        print(f"✅ Пачка голосов: принято {accepted} из {len(votes)}")
+
+# -------------------------------
+# Слушатели чатов в этом же процессе (CHAT_IN_PROCESS=1)
+# -------------------------------
+CHAT_IN_PROCESS = os.environ.get("CHAT_IN_PROCESS", "0") == "1"
 
-    async def _send_safe(c):
+VOTE_BATCH_MAX = 500
+
+async def dispatch_votes(batch: list):
+    """Пачка голосов из чатов — каждому шоу его часть по маршрутам SHOWS"""
+    for show, votes in route_votes(batch).items():
+        await handle_vote_batch(votes, show)
+
+async def consume_chat_queue(queue: asyncio.Queue, handler=dispatch_votes):
+    """Голоса из слушателей идут прямо в vote_manager: без JSON и loopback WebSocket"""
+    while True:
+        # Забираем всё, что накопилось, и принимаем одной пачкой
+        batch = [await queue.get()]
+        while len(batch) < VOTE_BATCH_MAX and not queue.empty():
+            batch.append(queue.get_nowait())
         try:
-            await c.send_str(msg)
-        except Exception:
+            await handler(batch)
+        except Exception as e:
+            print(f"⚠️ Ошибка обработки голосов: {e}")
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+def start_chat_listeners(handler=dispatch_votes):
+    import chat_listener
+    listeners = chat_listener.get_enabled_listeners()
+    for coro in [consume_chat_queue(chat_listener.msg_queue, handler), *listeners]:
+        _spawn_background(coro)
+    print(f"💬 Слушатели чатов запущены в процессе шоу: {len(listeners)}")
+    missing = [r for r in show_routes if r.startswith("#") and r not in chat_listener.twitch_channels(config.IRC_CHANNEL)]
+    if missing:
+        print(f"⚠️ Каналов из SHOWS нет в IRC_CHANNEL: {', '.join(missing)}")
+
+async def broadcast(msg: str, kind: str = None, show: Show = None):
+    """Рассылает уже сериализованное сообщение всем клиентам шоу через их очереди.
+
+    kind из DROPPABLE_KINDS ("phase", "votes", "rank") — у медленного клиента остаётся
+    только последнее такое сообщение; остальные доставляются обязательно.
+    """
+    for c in list((show or default_show).clients):
+        c.send(msg, kind)
+
+# Broadcast current vote counts and percentages to connected clients
+# Сколько раз в секунду максимум рассылать голоса (при всплеске чата)
+VOTE_BROADCAST_HZ = float(os.environ.get("VOTE_BROADCAST_HZ", 4))
+
+def votes_payload(show: Show = None) -> str:
+    state = (show or default_show).votes
+    counts, percentages, total = vote_manager.get_counts_and_percentages(state)
+    return json.dumps({"type": "votes", "counts": counts, "percentages": percentages, "total": total})
+
+async def broadcast_votes_once(show: Show = None):
+    show = show or default_show
+    show.votes_sent_version = show.votes.version
+    await broadcast(votes_payload(show), kind="votes", show=show)
+
+async def vote_broadcaster(rate: float = VOTE_BROADCAST_HZ):
+    """Склеивает голоса: рассылка раз в 1/rate секунд и только если счётчики изменились"""
+    interval = 1.0 / max(rate, 0.1)
+    while True:
+        for show in shows.values():
             try:
-                clients.discard(c)
+                if show.votes.version != show.votes_sent_version:
+                    await broadcast_votes_once(show)
             except Exception:
                 pass
+        await asyncio.sleep(interval)
 
-    for c in list(clients):
-        t = asyncio.create_task(_send_safe(c))
-        background_tasks.add(t)
-        t.add_done_callback(background_tasks.discard)
+# Как часто накопленные очки пишутся в SQLite (до этого они в памяти и в журнале)
+SCORE_FLUSH_INTERVAL = float(os.environ.get("SCORE_FLUSH_INTERVAL", 10))
 
-# Broadcast current vote counts and percentages to connected clients
-async def broadcast_votes_once():
-    counts, percentages, total = vote_manager.get_counts_and_percentages()
-    payload = json.dumps({"type": "votes", "counts": counts, "percentages": percentages, "total": total})
-    await broadcast(payload)
-
-async def broadcast_votes_periodic(interval=1.0):
+async def score_flusher(interval: float = SCORE_FLUSH_INTERVAL):
+    """Периодически сбрасывает очки в базу одной транзакцией"""
     while True:
-        try:
-            await broadcast_votes_once()
-        except Exception:
-            pass
         await asyncio.sleep(interval)
+        try:
+            await vote_manager.flush_scores_async()
+        except Exception as e:
+            print(f"⚠️ Не удалось записать очки в базу: {e}")
 
 # -------------------------------
 # Файловые операции (синхронные)
@@ -248,239 +640,563 @@ async def play_local_audio(audio_data: bytes):
     except (ImportError, AttributeError, NotImplementedError):
         pass
 
-async def speak_text(text: str, voice: str = "de-DE-KatjaNeural"):
-    """Генерирует аудио через Edge TTS и возвращает (base64, bytes)"""
-    if not edge_tts:
-        print("⚠️ Озвучка пропущена: библиотека 'edge-tts' не установлена или не загружена.")
-        return None, None
+class AudioStream:
+    """Клип, который ещё генерируется: чанки по порядку + признак конца клипа"""
+
+    __slots__ = ("key", "chunks", "done", "_changed")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks = []          # список, а не bytes += — без копирования на каждый чанк
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, data: bytes):
+        self.chunks.append(data)
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    async def wait_started(self):
+        """Ждёт первый чанк (или конец клипа, если генерация не удалась)"""
+        while not self.chunks and not self.done:
+            await self._changed.wait()
+
+    async def iter_chunks(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+# Синтезы, которые уже идут: ключ клипа -> задача (чтобы не генерировать дважды)
+_tts_inflight = {}
+# ...и их чанки для потоковой отдачи по /audio/<hash>
+_tts_streams = {}
+_tts_semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+
+def _start_synthesis(text: str, voice: str = tts_cache.DEFAULT_VOICE):
+    key = tts_cache.clip_key(text, voice)
+    task = _tts_inflight.get(key)
+    if task is None:
+        _tts_streams[key] = AudioStream(key)
+        task = asyncio.create_task(_synthesize(text, voice))
+        _tts_inflight[key] = task
+        task.add_done_callback(lambda _t: _tts_inflight.pop(key, None))
+    return task
+
+async def _synthesize(text: str, voice: str):
+    key = tts_cache.clip_key(text, voice)
+    stream = _tts_streams[key]
     try:
-        communicate = edge_tts.Communicate(text, voice)
-        import base64
-        
-        audio_data = b""
-        async for chunk in communicate.stream():
-            if chunk["type"] == "audio":
-                audio_data += chunk["data"]
-        
-        # Кодируем в base64 для отправки через WebSocket
-        audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-        return audio_base64, audio_data
+        async with _tts_semaphore:
+            communicate = edge_tts.Communicate(text, voice)
+
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    stream.append(chunk["data"])
+
+        if not stream.chunks:
+            return None
+
+        return tts_cache.put(text, voice, b"".join(stream.chunks))
     except Exception as e:
         print(f"Ошибка генерации аудио: {e}")
-        return None, None
+        return None
+    finally:
+        # К этому моменту клип уже в кэше — новые запросы пойдут туда
+        stream.finish()
+        _tts_streams.pop(key, None)
 
-async def speak_question_and_answers(quiz_text: str):
-    """Генерирует аудио для вопроса и вариантов ответов, отправляет в браузер"""
+def start_quiz_synthesis(quiz: quiz_bank.Quiz):
+    """Запускает параллельную генерацию всех ещё не готовых клипов квиза"""
     if not edge_tts:
+        return []
+    return [
+        _start_synthesis(text)
+        for text in (quiz.question, *quiz.options)
+        if text and tts_cache.get(text) is None
+    ]
+
+async def prefetch_quiz_audio(quiz: quiz_bank.Quiz):
+    """Заранее генерирует аудио следующего вопроса, пока идёт текущий"""
+    tasks = start_quiz_synthesis(quiz)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def speak_clip(text: str, is_question: bool, show: Show = None):
+    """Отправляет клип в браузер и проигрывает локально.
+
+    В потоковом режиме ссылка уходит сразу после первого чанка: браузер
+    получает MP3 по /audio/<hash> кусками, конец HTTP-ответа = конец клипа.
+    Локальный pygame умеет играть только целый клип, поэтому ждёт окончания.
+    """
+    clip = tts_cache.get(text)
+    streaming = False
+    if clip is None:
+        if not edge_tts:
+            print("⚠️ Озвучка пропущена: библиотека 'edge-tts' не установлена или не загружена.")
+            return
+        task = _start_synthesis(text)
+        key = tts_cache.clip_key(text)
+        stream = _tts_streams.get(key)
+        if TTS_STREAMING and stream is not None:
+            await stream.wait_started()
+            streaming = bool(stream.chunks)
+            if streaming:
+                await _broadcast_audio(key, text, is_question, streaming=True, show=show)
+        clip = await asyncio.shield(task)
+
+    if clip is None:
         return
-    
-    lines = [line.strip() for line in quiz_text.splitlines() if line.strip() and "✅" not in line]
-    
-    # Извлекаем вопрос и варианты ответов
-    question = ""
-    options = []
-    
-    for line in lines:
-        if line.startswith("Thema:"):
-            continue
-        # Проверяем, является ли строка вариантом ответа (A), B), C), D))
-        if re.match(r'^[A-D]\)\s*', line, re.IGNORECASE):
-            options.append(line)
-        elif not question and line:
-            question = line
-    
+    if not streaming:
+        await _broadcast_audio(clip.key, text, is_question, show=show)
+
+    # Проигрываем локально ПОСЛЕ отправки в вебсокет
+    if (show or default_show).primary:
+        await play_local_audio(clip.data)
+
+async def _broadcast_audio(key: str, text: str, is_question: bool, streaming: bool = False, show: Show = None):
+    # В WebSocket уходит только ссылка — сам MP3 браузер берёт по HTTP (и кэширует)
+    show = show or default_show
+    url = f"/audio/{key}{tts_cache.CLIP_EXT}"
+    if show.name != DEFAULT_SHOW:
+        # По ?show= роутер шардов находит процесс, где клип генерируется
+        url += f"?show={show.name}"
+    try:
+        await broadcast(json.dumps({
+            "type": "audio",
+            "hash": key,
+            "url": url,
+            "text": text,
+            "isQuestion": is_question,
+            "streaming": streaming
+        }), show=show)
+    except Exception as e:
+        print(f"Ошибка отправки аудио: {e}")
+
+async def speak_question_and_answers(quiz: quiz_bank.Quiz, show: Show = None):
+    """Генерирует аудио для вопроса и вариантов ответов, отправляет в браузер"""
+    question, options = quiz.question, quiz.options
+
+    # Все клипы генерируются сразу (с лимитом TTS_CONCURRENCY),
+    # а отправляются и проигрываются строго по порядку
+    start_quiz_synthesis(quiz)
+
     # Генерируем и отправляем аудио для вопроса
     if question:
-        print(f"🔊 Генерирую аудио для вопроса: {question}")
-        audio_base64, audio_bytes = await speak_text(question)
-        if audio_base64:
-            try:
-                await broadcast(json.dumps({
-                    "type": "audio",
-                    "audio": audio_base64,
-                    "text": question,
-                    "isQuestion": True
-                }))
-                print("📡 Аудио данные отправлены в браузер")
-            except Exception as e:
-                print(f"Ошибка отправки аудио: {e}")
-            
-            # Проигрываем локально ПОСЛЕ отправки в вебсокет
-            if audio_bytes:
-                await play_local_audio(audio_bytes)
+        print(f"🔊 Озвучка вопроса: {question}")
+        await speak_clip(question, is_question=True, show=show)
 
         # Пауза после вопроса перед вариантами ответов
         await asyncio.sleep(1.5)
     
     # Генерируем и отправляем аудио для вариантов ответов
     for option in options:
-        print(f"🔊 Генерирую аудио для варианта: {option}")
-        audio_base64, audio_bytes = await speak_text(option)
-        if audio_base64:
-            try:
-                await broadcast(json.dumps({
-                    "type": "audio",
-                    "audio": audio_base64,
-                    "text": option,
-                    "isQuestion": False
-                }))
-            except Exception as e:
-                print(f"Ошибка отправки аудио: {e}")
-            
-            if audio_bytes:
-                await play_local_audio(audio_bytes)
+        print(f"🔊 Озвучка варианта: {option}")
+        await speak_clip(option, is_question=False, show=show)
 
         await asyncio.sleep(0.3)  # Пауза между вариантами
 
 # -------------------------------
 # Логика показа вопроса и вещания таймера
 # -------------------------------
-async def show_question_with_answer(quiz_text):
-    lines = quiz_text.splitlines()
-
-    # Извлекаем правильный ответ из строки с "✅"
-    correct_answer_line = next((line for line in lines if "✅" in line), None)
-    correct_letter = None
-    correct_text = None
-    if correct_answer_line:
-        # убираем чекмарку и пробелы
-        clean = correct_answer_line.replace('✅', '').strip()
-        # попытка вытащить букву формата 'A) текст'
-        m = re.match(r'^([A-Z])\)\s*(.*)$', clean)
-        if m:
-            correct_letter = m.group(1)
-            correct_text = m.group(2).strip()
-        else:
-            # если формат другой — используем весь текст как правильный ответ
-            correct_text = clean
-    else:
-        correct_text = "Nicht gefunden"
+# Все дедлайны — в часах loop.time() (монотонные); текущая фаза шоу — Show.current_phase
 
-    # Убираем строку с правильным ответом из вопроса
-    question_lines = [line for line in lines if "✅" not in line]
-    question_text = "\n".join(question_lines)
+def phase_payload(phase: str, deadline: float) -> str:
+    """Фаза с абсолютным дедлайном в мс времени сервера; server_time — для сверки часов клиента"""
+    now = time.time()
+    remaining = max(0.0, deadline - asyncio.get_running_loop().time())
+    return json.dumps({
+        "type": "phase",
+        "phase": phase,
+        "server_time": round(now * 1000),
+        "deadline": round((now + remaining) * 1000),
+    })
+
+async def start_phase(phase: str, deadline: float, show: Show = None):
+    show = show or default_show
+    show.current_phase = (phase, deadline)
+    try:
+        await broadcast(phase_payload(phase, deadline), kind="phase", show=show)
+    except Exception:
+        pass
+
+async def sleep_until(deadline: float):
+    """Спит до момента loop.time() == deadline — погрешность sleep не накапливается"""
+    delay = deadline - asyncio.get_running_loop().time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+async def show_question_with_answer(quiz: quiz_bank.Quiz, started_at: float, show: Show = None):
+    """Раунд по абсолютному расписанию: ответ в started_at + ANSWER_DELAY, конец в started_at + QUIZ_INTERVAL"""
+    show = show or default_show
+    correct_letter = quiz.correct_letter
+    correct_text = quiz.correct_text
 
     # Показ вопроса (без правильного ответа) — вещаем по WebSocket
     # Подготовим мета-информацию (текущий/total будут передаваться из main_loop)
     # clear answer file
-    clear_answer()
-    print(f"Показан вопрос: {question_lines[1] if len(question_lines) > 1 else 'N/A'}")
+    if show.primary:
+        clear_answer()
+    print(f"[{show.name}] Показан вопрос: {quiz.question}")
 
     # broadcast question will be sent by caller with metadata
 
-    # Таймер обратного отсчета — вещаем каждую секунду по WebSocket
-    for sec in range(TIMER_START, 0, -1):
-        try:
-            await broadcast(json.dumps({"type": "timer", "seconds": sec}))
-        except Exception:
-            pass
-        await asyncio.sleep(1)
+    # Обратный отсчёт считают оверлеи сами — шлём один раз фазу с дедлайном
+    answer_at = started_at + ANSWER_DELAY
+    await start_phase("question", answer_at, show)
+    await sleep_until(answer_at)
 
     # Закрываем голосование после истечения времени
-    vote_manager.set_voting_open(False)
+    vote_manager.set_voting_open(False, show.votes)
 
     # Показ правильного ответа в отдельном файле
     # Подготовим текст и запишем в файл
     answer_text = f"✅ Richtige Antwort: {correct_text}"
-    write_answer(answer_text)
+    if show.primary:
+        write_answer(answer_text)
     try:
-        await broadcast(json.dumps({"type": "answer", "text": answer_text, "correct_text": correct_text, "correct_letter": correct_letter}))
+        await broadcast(json.dumps({"type": "answer", "text": answer_text, "correct_text": correct_text, "correct_letter": correct_letter}), show=show)
     except Exception:
         pass
     print(f"Показан правильный ответ: {correct_text}")
-    # Award points to users who answered correctly
+    # Начисляем очки: база + бонус за скорость + бонус за серию правильных ответов
     try:
         if correct_letter:
-            voters = vote_manager.get_voters_for_letter(correct_letter)
-            if voters:
-                vote_manager.award_points(voters, points=1)
+            awarded = await vote_manager.score_question_async(correct_letter, show.votes)
+            if awarded:
+                print(f"🏅 Очки начислены: {len(awarded)} игрокам, максимум {max(awarded.values())}")
     except Exception:
         pass
     
     # Обновляем лидерборд из базы при каждом ответе
     try:
-        leaderboard = vote_manager.get_top_scores(10)
-        await broadcast(json.dumps({"type": "scores", "leaderboard": leaderboard}))
+        leaderboard = await vote_manager.get_top_scores_async(10)
+        await broadcast(json.dumps({"type": "scores", "leaderboard": leaderboard}), show=show)
     except Exception:
         pass
-    # После показа правильного ответа — вещаем таймер до следующего вопроса
-    post_wait = QUIZ_INTERVAL - ANSWER_DELAY
-    if post_wait > 0:
-        for sec in range(post_wait, 0, -1):
-            try:
-                await broadcast(json.dumps({"type": "timer", "seconds": sec, "phase": "answer_wait"}))
-            except Exception:
-                pass
-            await asyncio.sleep(1)
+    # После показа правильного ответа — отсчёт до следующего вопроса
+    next_at = started_at + QUIZ_INTERVAL
+    await start_phase("answer_wait", next_at, show)
+    await sleep_until(next_at)
 
 # -------------------------------
 # Основной async цикл
 # -------------------------------
 background_tasks = set()
 
-async def main_loop():
-    global used_indices
+def set_quiz_filter(value, show: Show = None):
+    """Меняет фильтр на ходу — со следующего вопроса; у каждого фильтра свой круг"""
+    global QUIZ_FILTER
+    show = show or default_show
+    show.quiz_filter = value or None
+    if show is default_show:
+        QUIZ_FILTER = show.quiz_filter
+    picker = show.picker()
+    print(f"🎯 [{show.name}] Фильтр квизов: {show.quiz_filter or 'все'} ({len(picker.items)} вопросов)")
+    return picker
+
+def swap_quiz_bank(new_quizzes):
+    """Атомарно подменяет банк и индексы шоу; текущие раунды держат свой Quiz и не прерываются"""
+    global all_quizzes, quiz_index
+    new_indexes = {}
+    for show in shows.values():
+        new_index = quiz_bank.QuizIndex(new_quizzes)
+        new_index.adopt_history(show.index)
+        new_indexes[show.name] = new_index
+    all_quizzes = new_quizzes
+    for show in shows.values():
+        show.index = new_indexes[show.name]
+    quiz_index = default_show.index
+
+async def watch_quiz_file(interval: float = QUIZ_RELOAD_INTERVAL):
+    """Следит за ALL_QUIZZES_FILE и подхватывает изменения без перезапуска шоу"""
+    global quiz_file_seen
     while True:
-        # Формируем список валидных индексов по фильтру (если задан)
-        if QUIZ_FILTER:
-            valid_idxs = [i for i, q in enumerate(all_quizzes) if QUIZ_FILTER in q]
-            if not valid_idxs:
-                print(f"Фильтр '{QUIZ_FILTER}' не дал совпадений. Будут использованы все квизы.")
-                valid_idxs = list(range(len(all_quizzes)))
-        else:
-            valid_idxs = list(range(len(all_quizzes)))
+        await asyncio.sleep(interval)
+        current = quiz_file_signature()
+        if current is None or current == quiz_file_seen:
+            continue
+        quiz_file_seen = current
 
-        # Сбрасываем историю только когда все подходящие вопросы показаны
-        if len(used_indices) == len(valid_idxs):
-            print("Все вопросы показаны. Сбрасываем историю...")
-            used_indices.clear()
+        try:
+            # quiz_memo хранит разбор прошлой версии: заново разбираются только новые блоки
+            new_quizzes, _ = quiz_bank.reload_bank(ALL_QUIZZES_FILE, quiz_memo)
+        except Exception as e:
+            print(f"⚠️ Не удалось перечитать {ALL_QUIZZES_FILE}: {e}")
+            continue
+        if not new_quizzes:
+            print(f"⚠️ {ALL_QUIZZES_FILE}: после изменения не найдено ни одного квиза — оставляем старый банк")
+            continue
 
-        available = [i for i in valid_idxs if i not in used_indices]
-        idx = random.choice(available)
-        used_indices.add(idx)
+        added, removed, kept = quiz_bank.diff_banks(all_quizzes, new_quizzes)
+        if not added and not removed:
+            continue
+        swap_quiz_bank(new_quizzes)
+        print(f"🔄 Банк квизов обновлён: +{added} / -{removed} (без изменений: {kept}), всего {len(all_quizzes)}")
+
+def _spawn_background(coro):
+    t = asyncio.create_task(coro)
+    background_tasks.add(t)
+    t.add_done_callback(background_tasks.discard)
+    return t
+
+async def main_loop(show: Show = None):
+    # Раунды привязаны к одной точке отсчёта: n-й вопрос начинается ровно в
+    # next_start = старт + n * QUIZ_INTERVAL, как бы долго ни шли рассылки
+    show = show or default_show
+    loop = asyncio.get_running_loop()
+    next_start = loop.time()
+    while True:
+        picker = show.picker()
+        idx = picker.draw()
         quiz = all_quizzes[idx]
 
         # Сбрасываем счётчики голосов перед показом нового вопроса
-        vote_manager.reset_question()
-        vote_manager.set_voting_open(True)
+        vote_manager.reset_question(show.votes)
+        vote_manager.set_voting_open(True, show.votes)
         # Отправляем вопрос как JSON (включая номер и общее количество)
-        lines = [l for l in quiz.splitlines() if l.strip() and "✅" not in l]
-        question_text = "\n".join(lines)
-        meta = {"type": "question", "text": question_text, "current": len(used_indices), "total": len(valid_idxs)}
+        meta = {"type": "question", "text": quiz.text, "current": picker.drawn, "total": len(picker.items)}
         try:
             # send initial zeroed votes so overlay shows 0% immediately
-            await broadcast(json.dumps(meta))
-            await broadcast_votes_once()
+            await broadcast(json.dumps(meta), show=show)
+            await broadcast_votes_once(show)
             # Отправляем актуальный лидерборд в начале каждого вопроса
-            leaderboard = vote_manager.get_top_scores(10)
-            await broadcast(json.dumps({"type": "scores", "leaderboard": leaderboard}))
+            leaderboard = await vote_manager.get_top_scores_async(10)
+            await broadcast(json.dumps({"type": "scores", "leaderboard": leaderboard}), show=show)
         except Exception:
             pass
 
         # Озвучиваем вопрос и варианты ответов
         try:
-            t = asyncio.create_task(speak_question_and_answers(quiz))
-            background_tasks.add(t)
-            t.add_done_callback(background_tasks.discard)
+            _spawn_background(speak_question_and_answers(quiz, show))
         except Exception as e:
             print(f"Ошибка запуска озвучки: {e}")
 
-        await show_question_with_answer(quiz)
+        # Выбираем следующий вопрос заранее и генерируем его аудио,
+        # пока идёт обратный отсчёт текущего
+        try:
+            _spawn_background(prefetch_quiz_audio(all_quizzes[picker.peek()]))
+        except Exception as e:
+            print(f"Ошибка запуска предзагрузки озвучки: {e}")
+
+        await show_question_with_answer(quiz, next_start, show)
+        next_start += QUIZ_INTERVAL
+        if next_start < loop.time():
+            # Процесс подвис дольше раунда — не пытаемся догонять пропущенные
+            next_start = loop.time()
 
         # Ненужный дополнительный sleep удалён — показ правильного ответа
-        # и отправка таймеров до следующего вопроса уже выполняются в
+        # и ожидание до следующего вопроса уже выполняются в
         # show_question_with_answer(), поэтому здесь спать не нужно.
 
-async def main():
-    setup_local_audio()
-    start_background_music()
-    
-    # Настраиваем aiohttp приложение
+def create_app() -> web.Application:
+    """aiohttp приложение шоу (используется и в main, и в bench_chat_flood.py)"""
     app = web.Application()
     # Один обработчик на все маршруты (он сам разберется, WS это или HTTP)
     app.router.add_get('/', handle_all)
     app.router.add_get('/mobile', handle_all)
+    app.router.add_get('/show/{show}', handle_all)
+    app.router.add_get('/show/{show}/mobile', handle_all)
     app.router.add_get('/health', handle_all)
+    app.router.add_get('/admin/filter', handle_admin_filter)
+    app.router.add_get('/audio/{name}', handle_audio)
+    return app
+
+# -------------------------------
+# Процесс на шоу (SHARD_PROCESSES=1): роутер на PORT + дочерний сервер на каждое шоу
+# -------------------------------
+# Роутер отдаёт клиента процессу его шоу (по /show/<имя> или ?show=<имя>) и
+# перезапускает упавшие процессы. Все шарды пишут очки в одну WAL-базу, у
+# каждого свой журнал write-behind; кэш TTS общий через каталог на диске.
+# Голоса из чатов (слушатели в роутере при CHAT_IN_PROCESS=1 или chat_listener.py
+# без SHOW) роутер раскладывает по маршрутам SHOWS и пересылает шардам.
+SHARD_PROCESSES = os.environ.get("SHARD_PROCESSES", "0") == "1"
+SHARD_BASE_PORT = int(os.environ.get("SHARD_BASE_PORT", WS_PORT + 1))
+SHARD_RESTART_DELAY = 3
+PROXY_HEADERS = ("Content-Type", "Content-Length", "Cache-Control", "ETag", "Access-Control-Allow-Origin")
+
+_shard_ports = {}   # имя шоу -> порт его процесса
+_shard_links = {}   # имя шоу -> WebSocket роутера к процессу шоу для голосов
+_shard_session = None
+
+async def run_shard(show: Show, port: int):
+    """Держит процесс шоу живым; при отмене завершает его"""
+    env = dict(os.environ)
+    env.update({
+        "SHOWS": format_show(show),
+        "PORT": str(port),
+        "SHARD_PROCESSES": "0",
+        "SHOW_PRIMARY": "1" if show.primary else "0",
+        # Голоса из чатов пересылает роутер (или chat_listener.py с SHOW=<имя>)
+        "CHAT_IN_PROCESS": "0",
+        "SCORES_SHARED_DB": "1",
+        "SCORES_JOURNAL_SUFFIX": f".journal-{show.name}",
+    })
+    while True:
+        proc = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), env=env)
+        print(f"🧩 Шоу {show.name}: процесс {proc.pid} на порту {port}")
+        try:
+            code = await proc.wait()
+        except asyncio.CancelledError:
+            if proc.returncode is None:
+                proc.terminate()
+                await proc.wait()
+            raise
+        print(f"⚠️ Процесс шоу {show.name} завершился (код {code}), перезапуск через {SHARD_RESTART_DELAY}с")
+        await asyncio.sleep(SHARD_RESTART_DELAY)
+
+async def forward_votes_to_shards(batch: list):
+    """Голоса из чатов — в процессы шоу по маршрутам SHOWS, одной пачкой на шоу"""
+    for show, votes in route_votes(batch).items():
+        await _send_to_shard(show.name, json.dumps({"type": "vote_batch", "votes": votes}))
+
+async def _send_to_shard(name: str, msg: str):
+    ws = _shard_links.get(name)
+    try:
+        if ws is None or ws.closed:
+            ws = await _shard_session.ws_connect(f"http://127.0.0.1:{_shard_ports[name]}/?show={name}")
+            _shard_links[name] = ws
+            # Рассылки шоу этому соединению не нужны — вычитываем, чтобы не копились
+            _spawn_background(_drain_ws(ws))
+        await ws.send_str(msg)
+    except (ClientError, ConnectionError) as e:
+        _shard_links.pop(name, None)
+        print(f"⚠️ Шоу {name} недоступно, голоса потеряны: {e}")
+
+async def _drain_ws(ws):
+    async for _ in ws:
+        pass
+
+async def _route_client_votes(text: str) -> bool:
+    """Голоса от клиента без явного шоу раскладываются по маршрутам; True — сообщение забрано"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return False
+    if not isinstance(data, dict):
+        return False
+    kind = data.get("type")
+    if kind == "vote_batch":
+        await forward_votes_to_shards(data.get("votes") or [])
+    elif kind == "remote_vote":
+        await forward_votes_to_shards([data])
+    else:
+        return False
+    return True
+
+async def _pump_ws(src, dst, route_votes_here: bool = False):
+    async for msg in src:
+        if msg.type == WSMsgType.TEXT:
+            if route_votes_here and await _route_client_votes(msg.data):
+                continue
+            await dst.send_str(msg.data)
+        elif msg.type == WSMsgType.BINARY:
+            await dst.send_bytes(msg.data)
+        else:
+            break
+
+async def handle_shard_proxy(request):
+    path = request.path
+    if path == "/health":
+        return web.Response(text="OK")
+    if path.startswith("/show/"):
+        name = path.split("/")[2]
+    else:
+        name = request.query.get("show") or default_show.name
+    port = _shard_ports.get(name.lower())
+    if port is None:
+        return web.Response(text="Show not found", status=404)
+    url = f"http://127.0.0.1:{port}{request.rel_url}"
+
+    try:
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            async with _shard_session.ws_connect(url) as upstream:
+                ws = web.WebSocketResponse()
+                await ws.prepare(request)
+                explicit = path.startswith("/show/") or bool(request.query.get("show"))
+                pumps = [asyncio.create_task(_pump_ws(ws, upstream, route_votes_here=not explicit)),
+                         asyncio.create_task(_pump_ws(upstream, ws))]
+                try:
+                    await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in pumps:
+                        task.cancel()
+                await ws.close()
+                return ws
+
+        headers = {k: v for k, v in request.headers.items() if k in ("If-None-Match", "Accept")}
+        async with _shard_session.get(url, headers=headers, allow_redirects=False) as upstream:
+            resp = web.StreamResponse(status=upstream.status)
+            for key in PROXY_HEADERS:
+                if key in upstream.headers:
+                    resp.headers[key] = upstream.headers[key]
+            await resp.prepare(request)
+            # Стримим как есть: клип TTS может ещё генерироваться
+            async for chunk in upstream.content.iter_any():
+                await resp.write(chunk)
+            await resp.write_eof()
+            return resp
+    except ClientError:
+        return web.Response(text="Show is restarting", status=502)
+
+async def run_shard_router():
+    global _shard_session
+    _shard_session = ClientSession()
+    tasks = []
+    for i, show in enumerate(shows.values()):
+        port = SHARD_BASE_PORT + i
+        _shard_ports[show.name] = port
+        tasks.append(asyncio.create_task(run_shard(show, port)))
+
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', handle_shard_proxy)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WS_HOST, WS_PORT)
+    await site.start()
+    print(f"Shard router running on http://{WS_HOST}:{WS_PORT} ({', '.join(_shard_ports)})")
+    if CHAT_IN_PROCESS:
+        # Слушатели чатов живут в роутере: шарды запущены с CHAT_IN_PROCESS=0
+        start_chat_listeners(forward_votes_to_shards)
+    # SIGTERM от оркестратора приходит только роутеру — гасим и дочерние процессы
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for ws in list(_shard_links.values()):
+            await ws.close()
+        await runner.cleanup()
+        await _shard_session.close()
+
+async def main():
+    if SHARD_PROCESSES and len(shows) > 1:
+        await run_shard_router()
+        return
+
+    setup_local_audio()
+    start_background_music()
+    
+    # Настраиваем aiohttp приложение
+    app = create_app()
     
     runner = web.AppRunner(app)
     await runner.setup()
@@ -491,15 +1207,21 @@ async def main():
 
     # start background IRC listener and periodic vote broadcaster
     try:
-        for coro in [broadcast_votes_periodic(1.0)]:
-            t = asyncio.create_task(coro)
-            background_tasks.add(t)
-            t.add_done_callback(background_tasks.discard)
-        await main_loop()
+        coros = [vote_broadcaster(), score_flusher()]
+        if QUIZ_RELOAD_INTERVAL > 0:
+            coros.append(watch_quiz_file())
+        for coro in coros:
+            _spawn_background(coro)
+        if CHAT_IN_PROCESS:
+            start_chat_listeners()
+        # Каждое шоу — свой независимый цикл раундов в общем event loop
+        await asyncio.gather(*(main_loop(show) for show in shows.values()))
     except asyncio.CancelledError:
         pass
     finally:
         await runner.cleanup()
+        # close_db сначала дописывает накопленные очки
+        vote_manager.close_db()
 
 if __name__ == "__main__":
     try:
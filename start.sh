@@ -1,7 +1,12 @@
 #!/bin/bash
+# Режим одного процесса: слушатели чатов работают внутри квиз-сервера
+if [ "$CHAT_IN_PROCESS" = "1" ]; then
+    exec python quiz_stream_show.py
+fi
+
 # Запускаем основной квиз в фоновом режиме
 python quiz_stream_show.py &
 
 # Ждем пару секунд и запускаем слушателя чата
 sleep 5
-python chat_listener.py
\ No newline at end of file
+python chat_listener.py
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# ---------------- CONFIG ----------------
+
+DEFAULT_VOICE = "de-DE-KatjaNeural"
+
+CACHE_DIR = os.environ.get(
+    "TTS_CACHE_DIR", os.path.join(os.path.dirname(__file__), "tts_cache")
+)
+MEMORY_LIMIT_BYTES = int(os.environ.get("TTS_CACHE_MEMORY_MB", 64)) * 1024 * 1024
+DISK_LIMIT_BYTES = int(os.environ.get("TTS_CACHE_DISK_MB", 512)) * 1024 * 1024
+# Папку кэша могут делить несколько процессов: раз в столько секунд индекс
+# пересобирается по диску, чтобы учесть клипы, записанные другими
+DISK_RESCAN_SECONDS = float(os.environ.get("TTS_CACHE_RESCAN_SEC", 300))
+
+CLIP_EXT = ".mp3"
+
+# Готовый аудиопакет от prerender_audio.py (только чтение)
+PACK_DIR = os.environ.get(
+    "TTS_PACK_DIR", os.path.join(os.path.dirname(__file__), "audio_pack")
+)
+PACK_MANIFEST = "manifest.json"
+PACK_FORMAT = 1
+
+
+class CachedClip:
+    """Готовый аудиоклип: контентный ключ + MP3-байты"""
+
+    __slots__ = ("key", "data")
+
+    def __init__(self, key: str, data: bytes):
+        self.key = key
+        self.data = data
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+# ---------------- STATE ----------------
+
+_memory: "OrderedDict[str, CachedClip]" = OrderedDict()
+_memory_bytes = 0
+
+# key -> (size, mtime, который видел этот процесс), порядок = LRU
+_disk_index: Optional["OrderedDict[str, tuple]"] = None
+_disk_bytes = 0
+_disk_scanned_at = 0.0
+
+_pack_clips: Optional[Dict[str, dict]] = None     # key -> запись манифеста
+
+_stats: Dict[str, int] = {"memory_hits": 0, "pack_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+# ---------------- API ----------------
+
+def clip_key(text: str, voice: str = DEFAULT_VOICE) -> str:
+    """Контентный ключ клипа: одинаковый текст + голос → одинаковый ключ"""
+    return hashlib.sha256(f"{voice}\n{text}".encode("utf-8")).hexdigest()
+
+
+def get(text: str, voice: str = DEFAULT_VOICE) -> Optional[CachedClip]:
+    return get_by_key(clip_key(text, voice))
+
+
+def is_valid_key(key: str) -> bool:
+    return len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+
+def get_by_key(key: str) -> Optional[CachedClip]:
+    clip = _memory.get(key)
+    if clip is not None:
+        _memory.move_to_end(key)
+        _stats["memory_hits"] += 1
+        return clip
+
+    data = _pack_read(key)
+    if data is not None:
+        _stats["pack_hits"] += 1
+        return _memory_put(CachedClip(key, data))
+
+    data = _disk_read(key)
+    if data is None:
+        _stats["misses"] += 1
+        return None
+
+    _stats["disk_hits"] += 1
+    return _memory_put(CachedClip(key, data))
+
+
+def put(text: str, voice: str, data: bytes) -> CachedClip:
+    key = clip_key(text, voice)
+    clip = _memory_put(CachedClip(key, data))
+    _disk_write(key, data)
+    return clip
+
+
+def stats() -> Dict[str, int]:
+    return {
+        **_stats,
+        "memory_items": len(_memory),
+        "memory_bytes": _memory_bytes,
+        "pack_items": len(_pack_clips) if _pack_clips is not None else 0,
+        "disk_items": len(_disk_index) if _disk_index is not None else 0,
+        "disk_bytes": _disk_bytes,
+    }
+
+
+# ---------------- MEMORY ----------------
+
+def _memory_put(clip: CachedClip) -> CachedClip:
+    global _memory_bytes
+    old = _memory.pop(clip.key, None)
+    if old is not None:
+        _memory_bytes -= old.size
+
+    _memory[clip.key] = clip
+    _memory_bytes += clip.size
+
+    while _memory_bytes > MEMORY_LIMIT_BYTES and len(_memory) > 1:
+        _, evicted = _memory.popitem(last=False)
+        _memory_bytes -= evicted.size
+    return clip
+
+
+# ---------------- PACK ----------------
+
+def load_pack_manifest(pack_dir: str = PACK_DIR) -> Optional[dict]:
+    """Читает manifest.json аудиопакета; None, если пакета нет или формат чужой"""
+    try:
+        with open(os.path.join(pack_dir, PACK_MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Не удалось прочитать манифест аудиопакета: {e}")
+        return None
+
+    if manifest.get("format") != PACK_FORMAT:
+        print(f"⚠️ Неподдерживаемый формат аудиопакета: {manifest.get('format')}")
+        return None
+    return manifest
+
+
+def _load_pack() -> Dict[str, dict]:
+    global _pack_clips
+    if _pack_clips is None:
+        manifest = load_pack_manifest()
+        _pack_clips = manifest.get("clips", {}) if manifest else {}
+        if _pack_clips:
+            print(f"📦 Аудиопакет v{manifest.get('version')}: {len(_pack_clips)} клипов")
+    return _pack_clips
+
+
+def _pack_read(key: str) -> Optional[bytes]:
+    entry = _load_pack().get(key)
+    if not entry:
+        return None
+    try:
+        with open(os.path.join(PACK_DIR, entry["file"]), "rb") as f:
+            return f.read()
+    except (OSError, KeyError):
+        return None
+
+
+# ---------------- DISK ----------------
+
+def _clip_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key + CLIP_EXT)
+
+
+def _load_disk_index(rescan: bool = False) -> "OrderedDict[str, tuple]":
+    """Сканируем папку кэша при старте и раз в DISK_RESCAN_SECONDS; LRU — по mtime.
+
+    Папку могут делить несколько процессов (шарды шоу), поэтому индекс — лишь
+    подсказка: промах проверяется по диску, а кандидат на вытеснение
+    перепроверяется по mtime (см. _disk_evict).
+    """
+    global _disk_index, _disk_bytes, _disk_scanned_at
+    if _disk_index is not None and not rescan:
+        return _disk_index
+    _disk_scanned_at = time.monotonic()
+
+    entries = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(CLIP_EXT):
+                    st = e.stat()
+                    entries.append((st.st_mtime, e.name[:-len(CLIP_EXT)], st.st_size))
+    except FileNotFoundError:
+        pass
+
+    entries.sort()
+    _disk_index = OrderedDict((key, (size, mtime)) for mtime, key, size in entries)
+    _disk_bytes = sum(size for _, key, size in entries)
+    return _disk_index
+
+
+def _disk_read(key: str) -> Optional[bytes]:
+    global _disk_bytes
+    index = _load_disk_index()
+    path = _clip_path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        # Обновляем mtime, чтобы LRU переживал перезапуск и был виден другим процессам
+        now = time.time()
+        os.utime(path, (now, now))
+    except OSError:
+        _disk_forget(key)
+        return None
+    if key not in index:
+        # Клип записал другой процесс после нашего сканирования — принимаем в индекс
+        _disk_bytes += len(data)
+    index[key] = (len(data), now)
+    index.move_to_end(key)
+    return data
+
+
+def _disk_write(key: str, data: bytes):
+    path = _clip_path(key)
+    # Свой tmp у каждого процесса: шарды могут писать один клип одновременно
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        now = time.time()
+        os.utime(path, (now, now))
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить аудио в кэш: {e}")
+        return
+
+    global _disk_bytes
+    # Полный проход по папке (десятки тысяч stat) — только изредка
+    index = _load_disk_index(rescan=time.monotonic() - _disk_scanned_at > DISK_RESCAN_SECONDS)
+    _disk_forget(key)
+    index[key] = (len(data), now)
+    _disk_bytes += len(data)
+    _disk_evict(index)
+
+
+def _disk_evict(index: "OrderedDict[str, tuple]"):
+    """Вытесняет самые старые клипы; stat только у кандидатов, не у всей папки"""
+    checks = len(index)
+    while _disk_bytes > DISK_LIMIT_BYTES and len(index) > 1 and checks > 0:
+        checks -= 1
+        old_key, (size, seen_mtime) = next(iter(index.items()))
+        path = _clip_path(old_key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            # Уже удалён другим процессом
+            _disk_forget(old_key)
+            continue
+        if mtime > seen_mtime + 0.001:
+            # Клип использовал другой процесс — он не самый старый
+            index[old_key] = (size, mtime)
+            index.move_to_end(old_key)
+            continue
+        _disk_forget(old_key)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _disk_forget(key: str):
+    global _disk_bytes
+    if _disk_index is None:
+        return
+    entry = _disk_index.pop(key, None)
+    if entry is not None:
+        _disk_bytes -= entry[0]
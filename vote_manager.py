@@ -1,8 +1,12 @@
-from collections import defaultdict
+import asyncio
+import json
 import sqlite3
 import os
+import threading
 import time
-from typing import Dict, Tuple, Iterable
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set, Tuple, Iterable
 
 # ---------------- CONFIG ----------------
 
@@ -14,32 +18,138 @@ VALID_ANSWERS = {
 DB_PATH = os.path.join(os.path.dirname(__file__), "scores.db")
 
 MESSAGE_ID_TTL = 3600        # 1 час
+MESSAGE_ID_BUCKET = 300      # ID забываются корзинами по 5 минут
+MESSAGE_ID_MAX = 200_000     # жёсткий потолок памяти под ID сообщений
 DUPLICATE_TIME_WINDOW = 1   # 1 секунда
+MESSAGE_KEY_TTL = 30         # повтор того же текста ловим в пределах 30 секунд
+MESSAGE_KEY_MAX = 100_000
+
+# Очки за правильный ответ: база + бонус за скорость + бонус за серию
+BASE_POINTS = 1
+SPEED_BONUS_MAX = 3          # за ответ в первую же секунду
+SPEED_BONUS_HALF_LIFE = 5.0  # каждые 5 секунд бонус уменьшается вдвое
+STREAK_BONUS_EVERY = 3       # +1 за каждые 3 правильных ответа подряд
+STREAK_BONUS_MAX = 3
+
+
+class DedupRing:
+    """
+    Множество «уже видели» с ограниченной памятью: кольцо корзин-множеств по
+    времени. Устаревшая корзина выбрасывается целиком за O(1), при превышении
+    max_items досрочно уходит самая старая. Корзина вмещает не больше
+    bucket_cap ключей, дальше открывается новая с тем же номером — поэтому
+    вытеснение никогда не задевает свежие ключи. Проверка — O(числа корзин).
+    """
+
+    def __init__(self, ttl: float, bucket_seconds: float, max_items: int):
+        self.bucket_seconds = bucket_seconds
+        self.buckets_count = max(1, int(ttl // bucket_seconds))
+        self.max_items = max_items
+        self.bucket_cap = max(1, max_items // (self.buckets_count + 1))
+        self.ring: deque = deque()     # [(номер корзины, set)], старые слева
+        self.size = 0
+        self.stats = {"hits": 0, "inserts": 0, "expired": 0, "evicted": 0}
+
+    def seen(self, key) -> bool:
+        """True, если ключ уже встречался; иначе запоминает его"""
+        self._rotate(time.monotonic())
+        for _, bucket in self.ring:
+            if key in bucket:
+                self.stats["hits"] += 1
+                return True
+
+        number, bucket = self.ring[-1]
+        if len(bucket) >= self.bucket_cap:
+            bucket = set()
+            self.ring.append((number, bucket))
+        bucket.add(key)
+        self.size += 1
+        self.stats["inserts"] += 1
+        # Потолок памяти: досрочно забываем самые старые ключи, текущую корзину не трогаем
+        while self.size > self.max_items and len(self.ring) > 1:
+            self._drop_oldest("evicted")
+        return False
+
+    def clear(self):
+        self.ring.clear()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _rotate(self, now: float):
+        current = int(now // self.bucket_seconds)
+        while self.ring and self.ring[0][0] <= current - self.buckets_count:
+            self._drop_oldest("expired")
+        if not self.ring or self.ring[-1][0] != current:
+            self.ring.append((current, set()))
+
+    def _drop_oldest(self, reason: str):
+        _, bucket = self.ring.popleft()
+        self.size -= len(bucket)
+        self.stats[reason] += len(bucket)
+
+
+class Vote:
+    """Голос зрителя: буква + задержка от открытия голосования в мс"""
+
+    __slots__ = ("letter", "elapsed_ms")
+
+    def __init__(self, letter: str, elapsed_ms: int):
+        self.letter = letter
+        self.elapsed_ms = elapsed_ms
+
+class VoteState:
+    """
+    Голосование одного шоу: голоса текущего вопроса, счётчики и окно приёма.
+    У процесса с несколькими шоу (см. quiz_stream_show.Show) по одному на шоу;
+    функции модуля без state работают с default_state.
+    """
+
+    def __init__(self, name: str = "main"):
+        self.name = name
+        self.votes: Dict[str, Vote] = {}
+        # Счётчики ведутся при приёме голоса — статистика и победители без прохода по votes
+        self.vote_counts: Dict[str, int] = {letter: 0 for letter in ("A", "B", "C", "D")}
+        self.voters_by_letter: Dict[str, Set[Tuple[str, str]]] = {letter: set() for letter in ("A", "B", "C", "D")}
+        self.processed_messages = DedupRing(MESSAGE_KEY_TTL, DUPLICATE_TIME_WINDOW * 5, MESSAGE_KEY_MAX)
+        self.voting_open = False
+        self.question_start_time = 0.0
+        # Растёт при каждом изменении голосов — по нему видно, нужна ли новая рассылка
+        self.version = 0
+
 
 # ---------------- STATE ----------------
 
-votes: Dict[str, str] = {}
-processed_messages: Dict[Tuple, float] = {}
-global_message_ids: Dict[str, float] = {}
+default_state = VoteState()
 
-_voting_open = False
-question_start_time = 0.0
+# Старые имена модуля указывают на контейнеры шоу по умолчанию
+votes = default_state.votes
+vote_counts = default_state.vote_counts
+voters_by_letter = default_state.voters_by_letter
+processed_messages = default_state.processed_messages
+# ID сообщений платформ уникальны глобально — общий для всех шоу
+global_message_ids = DedupRing(MESSAGE_ID_TTL, MESSAGE_ID_BUCKET, MESSAGE_ID_MAX)
 
 
 # ---------------- VOTING ----------------
 
-def set_voting_open(is_open: bool):
-    global _voting_open, question_start_time
-    _voting_open = is_open
+def set_voting_open(is_open: bool, state: VoteState = None):
+    state = state or default_state
+    state.voting_open = is_open
     if is_open:
-        question_start_time = time.time()
-        print(f"🗳️ Голосование открыто ({question_start_time:.0f})")
-
-
-def reset_question():
-    votes.clear()
-    processed_messages.clear()
-    _cleanup_global_message_ids()
+        state.question_start_time = time.time()
+        print(f"🗳️ Голосование открыто ({state.question_start_time:.0f})")
+
+
+def reset_question(state: VoteState = None):
+    state = state or default_state
+    state.votes.clear()
+    for letter in state.vote_counts:
+        state.vote_counts[letter] = 0
+        state.voters_by_letter[letter].clear()
+    state.version += 1
+    state.processed_messages.clear()
     print(f"🔄 Вопрос сброшен | ID cache: {len(global_message_ids)}")
 
 
@@ -48,37 +158,86 @@ def accept_vote(
     username: str,
     message: str,
     timestamp: float | None = None,
-    message_id: str | None = None
+    message_id: str | None = None,
+    state: VoteState = None
 ) -> bool:
+    state = state or default_state
 
-    if not _voting_open or not username:
+    if not state.voting_open:
         return False
 
-    timestamp = _normalize_timestamp(timestamp)
-
-    if timestamp < question_start_time - 5:
+    letter = _accept(state, source, username, message, timestamp, message_id)
+    if not letter:
         return False
 
-    if message_id and _is_duplicate_message_id(source, message_id, timestamp):
-        return False
+    state.version += 1
+    print(f"✅ [{source}] {username} → {letter}")
+    return True
 
-    msg_key = _build_message_key(source, username, message, timestamp)
-    if msg_key in processed_messages:
-        return False
 
-    processed_messages[msg_key] = timestamp
+def accept_votes(batch: Iterable[dict], state: VoteState = None) -> int:
+    """
+    Пачка голосов за один проход: те же проверки и дедупликация, что в
+    accept_vote, но версия голосов растёт один раз и без print на каждый голос.
+    Элементы — словари с ключами source, username, message, timestamp, message_id;
+    битые элементы пропускаются, не обрывая пачку. Возвращает число принятых голосов.
+    """
+    state = state or default_state
+
+    if not state.voting_open:
+        return 0
+
+    accepted = 0
+    accept = _accept
+    try:
+        for v in batch:
+            if not isinstance(v, dict):
+                continue
+            if accept(
+                state, v.get("source", "unknown"), v.get("username"), v.get("message"),
+                v.get("timestamp"), v.get("message_id")
+            ):
+                accepted += 1
+    finally:
+        # Уже засчитанные голоса должны уйти в рассылку, даже если пачка оборвалась
+        if accepted:
+            state.version += 1
+    return accepted
+
+
+def _accept(state: VoteState, source, username, message, timestamp, message_id) -> str | None:
+    """Проверяет и записывает голос; возвращает букву или None"""
+    if not username or not isinstance(username, str) or not isinstance(message, str):
+        return None
+    if not isinstance(source, str):
+        return None
+    if timestamp is not None and (isinstance(timestamp, bool) or not isinstance(timestamp, (int, float))):
+        return None
+
+    timestamp = _normalize_timestamp(timestamp)
+
+    if timestamp < state.question_start_time - 5:
+        return None
+
+    if message_id and global_message_ids.seen(f"{source}:{message_id}"):
+        return None
+
+    if state.processed_messages.seen(_build_message_key(source, username, message, timestamp)):
+        return None
 
     uname = f"{source}:{username}"
-    if uname in votes:
-        return False
+    if uname in state.votes:
+        return None
 
     letter = _extract_answer(message)
     if not letter:
-        return False
+        return None
 
-    votes[uname] = letter
-    print(f"✅ [{source}] {username} → {letter}")
-    return True
+    elapsed_ms = max(0, int((timestamp - state.question_start_time) * 1000))
+    state.votes[uname] = Vote(letter, elapsed_ms)
+    state.vote_counts[letter] += 1
+    state.voters_by_letter[letter].add((source, username))
+    return letter
 
 
 # ---------------- HELPERS ----------------
@@ -98,19 +257,9 @@ def _build_message_key(source, username, message, timestamp):
     )
 
 
-def _is_duplicate_message_id(source, message_id, timestamp) -> bool:
-    key = f"{source}:{message_id}"
-    if key in global_message_ids:
-        return True
-    global_message_ids[key] = timestamp
-    return False
-
-
-def _cleanup_global_message_ids():
-    cutoff = time.time() - MESSAGE_ID_TTL
-    for k in list(global_message_ids):
-        if global_message_ids[k] < cutoff:
-            del global_message_ids[k]
+def is_answer(message: str) -> bool:
+    """Может ли сообщение стать голосом — для фильтрации болтовни ещё в слушателе"""
+    return _extract_answer(message) is not None
 
 
 def _extract_answer(message: str) -> str | None:
@@ -120,76 +269,417 @@ def _extract_answer(message: str) -> str | None:
     return VALID_ANSWERS.get(msg)
 
 
-# ---------------- STATS ----------------
+def speed_bonus(elapsed_ms: int) -> int:
+    return round(SPEED_BONUS_MAX * 0.5 ** (elapsed_ms / 1000 / SPEED_BONUS_HALF_LIFE))
+
+
+def streak_bonus(streak: int) -> int:
+    return min(streak // STREAK_BONUS_EVERY, STREAK_BONUS_MAX)
 
-def get_counts_and_percentages():
-    counts = defaultdict(int)
-    for v in votes.values():
-        counts[v] += 1
 
-    total = sum(counts.values())
+# ---------------- STATS ----------------
+
+def get_counts_and_percentages(state: VoteState = None):
+    state = state or default_state
+    vote_counts = state.vote_counts
+    counts = {k: v for k, v in vote_counts.items() if v}
+    total = len(state.votes)
     percentages = {
-        k: round((counts.get(k, 0) / total) * 100, 1) if total else 0.0
+        k: round((vote_counts[k] / total) * 100, 1) if total else 0.0
         for k in ("A", "B", "C", "D")
     }
-    return dict(counts), percentages, total
+    return counts, percentages, total
 
 
-def get_voters_for_letter(letter: str):
-    return [
-        tuple(uname.split(":", 1))
-        for uname, v in votes.items()
-        if v == letter
-    ]
+def get_voters_for_letter(letter: str, state: VoteState = None):
+    state = state or default_state
+    return list(state.voters_by_letter.get(letter, ()))
 
 
-# ---------------- DATABASE ----------------
+def get_dedup_stats(state: VoteState = None):
+    state = state or default_state
+    return {
+        "message_ids": {**global_message_ids.stats, "size": len(global_message_ids)},
+        "message_keys": {**state.processed_messages.stats, "size": len(state.processed_messages)},
+    }
 
-def _get_conn():
-    return sqlite3.connect(DB_PATH)
 
+# ---------------- DATABASE ----------------
 
-def init_db():
-    with _get_conn() as conn:
+# Одно долгоживущее соединение на весь процесс. Из event loop к нему ходят
+# через _db_executor (один поток), синхронные вызовы защищены _db_lock.
+_conn: sqlite3.Connection | None = None
+_db_lock = threading.Lock()
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scores-db")
+
+# SQL держим константами: sqlite3 кэширует подготовленные выражения по тексту
+_SQL_AWARD = """
+    INSERT INTO scores(username, score)
+    VALUES(?, ?)
+    ON CONFLICT(username)
+    DO UPDATE SET score = score + excluded.score
+"""
+_SQL_TOP = """
+    SELECT username, score
+    FROM scores
+    ORDER BY score DESC
+    LIMIT ?
+"""
+_SQL_USER_SCORE = "SELECT score FROM scores WHERE username = ?"
+# Ранг = сколько игроков строго выше + 1; по индексу idx_scores_score без сортировки таблицы
+_SQL_COUNT_ABOVE = "SELECT COUNT(*) FROM scores WHERE score > ?"
+_SQL_STREAK = "SELECT current, best FROM streaks WHERE username = ?"
+# Массовое чтение: WHERE username IN (...) пачками, в пределах лимита параметров SQLite
+_SQL_STREAKS_IN = "SELECT username, current, best FROM streaks WHERE username IN ({})"
+_SQL_SCORES_IN = "SELECT username, score FROM scores WHERE username IN ({})"
+SQL_IN_CHUNK = 500
+_SQL_SET_STREAK = """
+    INSERT INTO streaks(username, current, best)
+    VALUES(?, ?, ?)
+    ON CONFLICT(username)
+    DO UPDATE SET current = excluded.current, best = excluded.best
+"""
+_SQL_GET_META = "SELECT value FROM meta WHERE key = ?"
+_SQL_SET_META = "INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+
+# Кэш топа: первые TOP_CACHE_SIZE строк лидерборда, обновляется точечно в award_points
+TOP_CACHE_SIZE = 50
+_top_cache: list | None = None     # [(username, score)] по убыванию score
+
+# Write-behind: очки сначала копятся в памяти (и сразу видны в лидерборде),
+# а в SQLite уходят пачкой в flush_scores(). Каждое начисление до этого
+# записывается в журнал с fsync, чтобы пережить падение процесса.
+# журнал лежит рядом с базой: scores.db.journal; у каждого процесса-шарда свой
+JOURNAL_SUFFIX = os.environ.get("SCORES_JOURNAL_SUFFIX", ".journal")
+# База общая для нескольких процессов: кэш топа перечитывается после каждой записи
+SHARED_DB = os.environ.get("SCORES_SHARED_DB") == "1"
+_pending_deltas: Dict[str, int] = {}
+_pending_streaks: Dict[str, Tuple[int, int]] = {}   # username -> (текущая, лучшая)
+_journal_seq = 0                   # номер последней записи журнала
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=5000")
+        _init_schema(conn)
+        _replay_journal(conn)
+        _conn = conn
+    return _conn
+
+
+def _init_schema(conn: sqlite3.Connection):
+    with conn:
         conn.execute("""
             CREATE TABLE IF NOT EXISTS scores (
                 username TEXT PRIMARY KEY,
                 score INTEGER NOT NULL DEFAULT 0
             )
         """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_score ON scores(score DESC)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS streaks (
+                username TEXT PRIMARY KEY,
+                current INTEGER NOT NULL DEFAULT 0,
+                best INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+
+
+def init_db():
+    """Открывает соединение и создаёт схему (один раз за процесс)"""
+    with _db_lock:
+        _get_conn()
+
+
+def close_db():
+    """Сбрасывает накопленные очки в базу и закрывает соединение"""
+    global _conn
+    with _db_lock:
+        if _conn is not None:
+            _flush_locked(_conn)
+            _conn.close()
+            _conn = None
 
 
 def award_points(users: Iterable[Tuple[str, str]], points=1):
     users = {u for _, u in users}
-    if not users:
+    if not users or points == 0:
         return
 
-    init_db()
-    with _get_conn() as conn:
-        cur = conn.cursor()
-        cur.executemany("""
-            INSERT INTO scores(username, score)
-            VALUES(?, ?)
-            ON CONFLICT(username)
-            DO UPDATE SET score = score + excluded.score
-        """, [(u, points) for u in users])
+    with _db_lock:
+        conn = _get_conn()
+        _apply_locked(conn, {u: points for u in users}, {})
+        if points < 0:
+            # Снижение очков ломает точечное обновление топа — пишем сразу
+            _flush_locked(conn)
+            _invalidate_top_cache()
+
+
+def score_question(correct_letter: str, state: VoteState = None) -> Dict[str, int]:
+    """
+    Подводит итог вопроса по всем голосам: правильным — база + бонус за скорость
+    + бонус за серию, неправильным — обнуление серии. Возвращает {username: очки}.
+    """
+    votes = (state or default_state).votes
+    with _db_lock:
+        conn = _get_conn()
+        voters = [(uname.split(":", 1)[1], vote) for uname, vote in votes.items()]
+        # Серии всех проголосовавших — пачками из базы, а не запросом на голос
+        known = _streaks_of(conn, {username for username, _ in voters})
+        deltas: Dict[str, int] = {}
+        streaks: Dict[str, Tuple[int, int]] = {}
+        for username, vote in voters:
+            current, best = known.get(username, (0, 0))
+            if vote.letter == correct_letter:
+                current += 1
+                points = BASE_POINTS + speed_bonus(vote.elapsed_ms) + streak_bonus(current)
+                # Один ник на нескольких платформах — берём лучший результат
+                if points > deltas.get(username, 0):
+                    deltas[username] = points
+                streaks[username] = (current, max(best, current))
+            elif current and username not in streaks:
+                streaks[username] = (0, best)
+        _apply_locked(conn, deltas, streaks)
+    return deltas
+
+
+def get_streak(username: str) -> Tuple[int, int]:
+    """Текущая и лучшая серия правильных ответов подряд"""
+    with _db_lock:
+        return _streak_of(_get_conn(), username)
+
+
+def _streak_of(conn: sqlite3.Connection, username: str) -> Tuple[int, int]:
+    streak = _pending_streaks.get(username)
+    if streak is None:
+        streak = conn.execute(_SQL_STREAK, (username,)).fetchone() or (0, 0)
+    return tuple(streak)
+
+
+def _streaks_of(conn: sqlite3.Connection, usernames: Set[str]) -> Dict[str, Tuple[int, int]]:
+    """Серии для множества игроков: ещё не записанные + пачки IN (...) из базы"""
+    result = {u: _pending_streaks[u] for u in usernames if u in _pending_streaks}
+    for row in _select_in(conn, _SQL_STREAKS_IN, [u for u in usernames if u not in result]):
+        result[row[0]] = (row[1], row[2])
+    return result
+
+
+def _db_scores(conn: sqlite3.Connection, usernames: Set[str]) -> Dict[str, int]:
+    return {u: score for u, score in _select_in(conn, _SQL_SCORES_IN, list(usernames))}
+
+
+def _select_in(conn: sqlite3.Connection, sql: str, usernames: list):
+    for i in range(0, len(usernames), SQL_IN_CHUNK):
+        chunk = usernames[i:i + SQL_IN_CHUNK]
+        yield from conn.execute(sql.format(",".join("?" * len(chunk))), chunk)
+
+
+def _apply_locked(conn: sqlite3.Connection, deltas: Dict[str, int], streaks: Dict[str, Tuple[int, int]]):
+    """Журналирует начисление и кладёт его в очередь на запись"""
+    if not deltas and not streaks:
+        return
+    _journal_append(deltas, streaks)
+    for u, points in deltas.items():
+        _pending_deltas[u] = _pending_deltas.get(u, 0) + points
+    _pending_streaks.update(streaks)
+    if deltas:
+        _update_top_cache(conn, set(deltas))
+
+
+def flush_scores() -> int:
+    """Пишет накопленные очки в SQLite одной транзакцией; возвращает число игроков"""
+    with _db_lock:
+        if _conn is None:
+            return 0
+        return _flush_locked(_conn)
 
 
 def get_top_scores(limit=10):
-    init_db()
-    with _get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT username, score
-            FROM scores
-            ORDER BY score DESC
-            LIMIT ?
-        """, (limit,))
+    global _top_cache
+    with _db_lock:
+        conn = _get_conn()
+        if limit > TOP_CACHE_SIZE:
+            rows = _effective_top(conn, limit)
+        else:
+            if _top_cache is None:
+                _top_cache = _effective_top(conn, TOP_CACHE_SIZE)
+            rows = _top_cache[:limit]
         return [
             {"username": u, "score": s}
-            for u, s in cur.fetchall()
+            for u, s in rows
         ]
 
 
-# init DB on import
-init_db()
+def get_rank(username: str):
+    """Место и очки игрока: {"username", "rank", "score"} или None, если очков нет"""
+    with _db_lock:
+        conn = _get_conn()
+        row = conn.execute(_SQL_USER_SCORE, (username,)).fetchone()
+        if row is None and username not in _pending_deltas:
+            return None
+        score = (row[0] if row else 0) + _pending_deltas.get(username, 0)
+        above = conn.execute(_SQL_COUNT_ABOVE, (score,)).fetchone()[0]
+        # Поправка на ещё не записанные очки других игроков
+        db_scores = _db_scores(conn, set(_pending_deltas))
+        for u, delta in _pending_deltas.items():
+            if u == username:
+                continue
+            db_score = db_scores.get(u, 0)
+            if db_score <= score < db_score + delta:
+                above += 1
+    return {"username": username, "rank": above + 1, "score": score}
+
+
+def _effective_top(conn: sqlite3.Connection, limit: int) -> list:
+    """Топ из базы с учётом ещё не записанных очков (дельты неотрицательные)"""
+    rows = dict(conn.execute(_SQL_TOP, (limit,)).fetchall())
+    db_scores = _db_scores(conn, {u for u in _pending_deltas if u not in rows})
+    for u, delta in _pending_deltas.items():
+        rows[u] = (rows[u] if u in rows else db_scores.get(u, 0)) + delta
+    return sorted(rows.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+
+
+def _invalidate_top_cache():
+    global _top_cache
+    _top_cache = None
+
+
+def _update_top_cache(conn: sqlite3.Connection, users: Set[str]):
+    """Точечно обновляет кэш топа: O(победителей), без повторной сортировки таблицы"""
+    global _top_cache
+    if _top_cache is None:
+        return
+
+    cached = dict(_top_cache)
+    full = len(_top_cache) >= TOP_CACHE_SIZE
+    threshold = _top_cache[-1][1] if _top_cache else 0
+
+    db_scores = _db_scores(conn, users)
+    for u in users:
+        # Актуальные очки = база + ещё не записанная дельта
+        score = db_scores.get(u, 0) + _pending_deltas.get(u, 0)
+        # Игрок вне топа попадает в него, только если догнал последнего в кэше
+        if u in cached or not full or score >= threshold:
+            cached[u] = score
+
+    top = sorted(cached.items(), key=lambda kv: kv[1], reverse=True)
+    _top_cache = top[:TOP_CACHE_SIZE]
+
+
+# ---------------- WRITE-BEHIND JOURNAL ----------------
+
+def _journal_path() -> str:
+    return DB_PATH + JOURNAL_SUFFIX
+
+
+def _journal_meta_key() -> str:
+    return "journal_seq" if JOURNAL_SUFFIX == ".journal" else f"journal_seq{JOURNAL_SUFFIX}"
+
+
+def _journal_append(deltas: Dict[str, int], streaks: Dict[str, Tuple[int, int]]):
+    global _journal_seq
+    _journal_seq += 1
+    line = json.dumps([_journal_seq, deltas, streaks], ensure_ascii=False)
+    with open(_journal_path(), "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _flush_locked(conn: sqlite3.Connection) -> int:
+    if not _pending_deltas and not _pending_streaks:
+        return 0
+    rows = list(_pending_deltas.items())
+    streak_rows = [(u, cur, best) for u, (cur, best) in _pending_streaks.items()]
+    with conn:
+        conn.executemany(_SQL_AWARD, rows)
+        conn.executemany(_SQL_SET_STREAK, streak_rows)
+        # Номер журнала пишется в той же транзакции — повторный replay не задвоит очки
+        conn.execute(_SQL_SET_META, (_journal_meta_key(), _journal_seq))
+    _pending_deltas.clear()
+    _pending_streaks.clear()
+    _truncate_journal()
+    if SHARED_DB:
+        # Другие процессы тоже пишут очки — точечный кэш мог устареть
+        _invalidate_top_cache()
+    return len(rows)
+
+
+def _truncate_journal():
+    try:
+        with open(_journal_path(), "w", encoding="utf-8"):
+            pass
+    except OSError as e:
+        print(f"⚠️ Не удалось очистить журнал очков: {e}")
+
+
+def _replay_journal(conn: sqlite3.Connection):
+    """После падения дописывает в базу очки из журнала, которых там ещё нет"""
+    global _journal_seq
+    row = conn.execute(_SQL_GET_META, (_journal_meta_key(),)).fetchone()
+    applied = row[0] if row else 0
+    _journal_seq = applied
+
+    try:
+        with open(_journal_path(), "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return
+
+    deltas: Dict[str, int] = {}
+    streaks: Dict[str, list] = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue    # оборванная последняя строка
+        seq, entry = record[0], record[1]
+        entry_streaks = record[2] if len(record) > 2 else {}
+        _journal_seq = max(_journal_seq, seq)
+        if seq <= applied:
+            continue
+        for u, d in entry.items():
+            deltas[u] = deltas.get(u, 0) + d
+        # Серии хранятся целиком, а не дельтой — побеждает последняя запись
+        streaks.update(entry_streaks)
+
+    if deltas or streaks:
+        with conn:
+            conn.executemany(_SQL_AWARD, list(deltas.items()))
+            conn.executemany(_SQL_SET_STREAK, [(u, cur, best) for u, (cur, best) in streaks.items()])
+            conn.execute(_SQL_SET_META, (_journal_meta_key(), _journal_seq))
+        print(f"♻️ Восстановлены очки из журнала: {len(deltas)} игроков")
+    _truncate_journal()
+
+
+# Асинхронные обёртки: работа с БД не блокирует таймер и рассылку
+
+async def get_top_scores_async(limit=10):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, get_top_scores, limit)
+
+
+async def get_rank_async(username: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, get_rank, username)
+
+
+async def score_question_async(correct_letter: str, state: VoteState = None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, score_question, correct_letter, state)
+
+
+async def flush_scores_async():
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, flush_scores)